@@ -0,0 +1,199 @@
+# Purpose:
+# Activation likelihood estimation (ALE) on the extracted coordinates, as an in-process alternative to loading the
+# Sleuth/GingerALE text files into GingerALE by hand.  Follows GingerALE's algorithm:
+#   - each experiment's foci are blurred with a 3D Gaussian whose width depends on the number of subjects
+#     (Eickhoff et al. 2009:  between-template plus between-subject uncertainty, from // Subjects=N)
+#   - the modelled activation (MA) map of an experiment is the voxel-wise maximum over its foci (Turkeltaub et al. 2012),
+#     so several foci close together don't add up within an experiment
+#   - ALE = 1 - prod(1 - MA) over experiments
+#   - p-values come from the exact null distribution of ALE under spatial independence, built from histograms of
+#     each experiment's MA values (Eickhoff et al. 2012) - no permutations needed
+#   - voxel-wise threshold with false discovery rate (or uncorrected p)
+# Maps are computed on a downsampled MNI grid (4 mm by default) restricted to a brain mask, or the bounding box.
+# Talairach foci are converted to MNI first (see coordinate_transform.py).
+#
+# Note, needs numpy.  Maps are saved as .npz (ale, p, z, affine, mask) since nibabel isn't a dependency
+
+from functools import lru_cache
+from statistics import NormalDist
+
+import numpy as np
+
+from coordinate_store import SPACES
+from coordinate_transform import convert_space
+
+# MNI152 bounding box (mm), as used for the 2 mm template grid
+MNI_ORIGIN = np.array([-90.0, -126.0, -72.0])
+MNI_EXTENT = np.array([180.0, 216.0, 180.0])
+BINS = 10000  # histogram bins for MA and ALE values in [0, 1]
+
+
+class ALEGrid:
+    # voxel grid in MNI space;  mask (boolean, grid shape) restricts where ALE is computed and tested
+
+    def __init__(self, voxel_size=4.0, mask=None):
+        self.voxel_size = float(voxel_size)
+        self.shape = tuple(int(n) for n in np.floor(MNI_EXTENT / self.voxel_size).astype(int) + 1)
+        self.affine = np.eye(4)
+        self.affine[:3, :3] *= self.voxel_size
+        self.affine[:3, 3] = MNI_ORIGIN
+        self.mask = np.ones(self.shape, dtype=bool) if mask is None else np.asarray(mask, dtype=bool)
+
+    @classmethod
+    def from_brain_mask(cls, brain_mask, voxel_size=4.0):
+        # resample a brain mask ((mask, affine), see foci_qa.load_brain_mask) to the ALE grid by nearest voxel
+        grid = cls(voxel_size)
+        mask, affine = brain_mask
+        ijk = np.indices(grid.shape).reshape(3, -1).T
+        xyz = ijk * grid.voxel_size + MNI_ORIGIN
+        source = np.rint(np.c_[xyz, np.ones(len(xyz))] @ np.linalg.inv(affine).T)[:, :3].astype(int)
+        on_grid = np.all((source >= 0) & (source < mask.shape), axis=1)
+        inside = np.zeros(len(xyz), dtype=bool)
+        inside[on_grid] = mask[tuple(source[on_grid].T)]
+        grid.mask = inside.reshape(grid.shape)
+        return grid
+
+    def voxels(self, xyz):
+        # nearest voxel of each focus, and which foci fall on the grid
+        ijk = np.rint((np.asarray(xyz, dtype=np.float64) - MNI_ORIGIN) / self.voxel_size)
+        on_grid = np.all((ijk >= 0) & (ijk < self.shape), axis=1) & ~np.isnan(ijk).any(axis=1)
+        return np.where(on_grid[:, None], ijk, 0).astype(np.int64), on_grid
+
+
+def kernel_fwhm(N):
+    # Eickhoff et al. 2009:  spatial uncertainty between templates (5.7 mm) and between subjects (11.6 mm),
+    # the latter shrinking with the square root of the number of subjects;  as FWHM in mm
+    to_fwhm = np.sqrt(8.0 * np.log(2.0)) / (2.0 * np.sqrt(2.0 / np.pi))
+    uncertain_templates = 5.7 * to_fwhm
+    uncertain_subjects = 11.6 * to_fwhm / np.sqrt(N)
+    return np.sqrt(uncertain_subjects ** 2 + uncertain_templates ** 2)
+
+
+@lru_cache(maxsize=None)
+def gaussian_kernel(N, voxel_size):
+    # normalized 3D Gaussian (probabilities sum to 1) for N subjects, out to 3 sigma;  one per distinct N
+    sigma = kernel_fwhm(N) / np.sqrt(8.0 * np.log(2.0)) / voxel_size
+    radius = int(np.ceil(3 * sigma))
+    r = np.arange(-radius, radius + 1)
+    g = np.exp(-r ** 2 / (2 * sigma ** 2))
+    kernel = g[:, None, None] * g[None, :, None] * g[None, None, :]
+    kernel /= kernel.sum()
+    kernel.flags.writeable = False
+    return kernel, radius
+
+
+def ma_map(ijk, N, grid):
+    # modelled activation map of one experiment:  voxel-wise maximum of its foci's kernels
+    kernel, radius = gaussian_kernel(int(N), grid.voxel_size)
+    ma = np.zeros(grid.shape)
+    for focus in ijk:
+        low = focus - radius
+        high = focus + radius + 1
+        clip_low = np.maximum(low, 0)
+        clip_high = np.minimum(high, grid.shape)
+        target = tuple(slice(a, b) for a, b in zip(clip_low, clip_high))
+        source = tuple(slice(a, b) for a, b in zip(clip_low - low, kernel.shape - (high - clip_high)))
+        np.maximum(ma[target], kernel[source], out=ma[target])
+    return ma
+
+
+def value_histogram(values, n_voxels):
+    # probabilities of binned values (MA or ALE) over the n_voxels of the mask;  values not given are zero
+    counts = np.bincount(np.minimum((values * BINS).astype(np.int64), BINS), minlength=BINS + 1).astype(np.float64)
+    counts[0] += n_voxels - len(values)
+    return counts / n_voxels
+
+
+def null_histogram(ma_histograms):
+    # distribution of ALE at a voxel if every experiment's MA value were drawn independently from its own histogram:
+    # combine one experiment at a time, ALE' = 1 - (1 - ALE)(1 - MA), over the non-empty bins only
+    bin_values = np.arange(BINS + 1) / BINS
+    ale_hist = np.zeros(BINS + 1)
+    ale_hist[0] = 1.0
+    for ma_hist in ma_histograms:
+        ale_bins = np.flatnonzero(ale_hist)
+        ma_bins = np.flatnonzero(ma_hist)
+        combined = 1.0 - np.outer(1.0 - bin_values[ale_bins], 1.0 - bin_values[ma_bins])
+        weights = np.outer(ale_hist[ale_bins], ma_hist[ma_bins])
+        ale_hist = np.bincount(np.minimum((combined.ravel() * BINS).astype(np.int64), BINS), weights=weights.ravel(), minlength=BINS + 1)
+    return ale_hist
+
+
+def fdr_threshold(p, q=0.05):
+    # Benjamini-Hochberg:  largest p-value still significant at false discovery rate q, or 0 if none are
+    p_sorted = np.sort(p)
+    below = p_sorted <= q * np.arange(1, len(p_sorted) + 1) / len(p_sorted)
+    return p_sorted[np.flatnonzero(below)[-1]] if below.any() else 0.0
+
+
+def experiment_foci(table, grid, rows=None):
+    # {experiment index: (voxel indices of its foci, N)} for the table rows selected (default all),
+    # in MNI space;  experiments with unknown sample size (N=0) are left out
+    if rows is not None:
+        table = table.subset(rows)
+    if (table.space != SPACES.index('MNI')).any():
+        table = convert_space(table, 'MNI')
+    ijk, on_grid = grid.voxels(table.xyz)
+    keep = on_grid & (table.experiment_N[table.experiment] > 0)
+    experiment, ijk = table.experiment[keep], ijk[keep]
+    if len(experiment) == 0:
+        return {}  # empty pool, e.g. no BD studies for a factor
+    # rows of each experiment are contiguous in the table;  split at the boundaries
+    starts = np.flatnonzero(np.r_[True, experiment[1:] != experiment[:-1]])
+    return {int(experiment[start]): (foci, int(table.experiment_N[experiment[start]]))
+            for start, foci in zip(starts, np.split(ijk, starts[1:]))}
+
+
+def ale(experiments, grid, q=0.05, p_uncorrected=None, ma_maps=None):
+    # experiments:  {experiment: (foci voxel indices, N)}, see experiment_foci.
+    # ma_maps, if given, is called as ma_maps(experiment, ijk, N) instead of computing each MA map here
+    # Returns a dict with the ALE, p and z maps (grid shape;  outside the mask ALE is 0 and p is 1),
+    # the p threshold used and the significant voxels (mask of the grid).  No experiments gives ALE 0 and p 1 everywhere
+    n_voxels = int(grid.mask.sum())
+    complement = np.ones(n_voxels)
+    ma_histograms = []
+    for experiment, (ijk, N) in experiments.items():
+        ma = ma_maps(experiment, ijk, N) if ma_maps is not None else ma_map(ijk, N, grid)
+        ma = ma[grid.mask]
+        complement *= 1.0 - ma
+        ma_histograms.append(value_histogram(ma[ma > 0], n_voxels))
+    ale_values = 1.0 - complement
+
+    # p = probability under the null of an ALE value at least this high
+    null = null_histogram(ma_histograms)
+    survival = np.clip(np.cumsum(null[::-1])[::-1], 0.0, 1.0)
+    ale_bins = np.minimum((ale_values * BINS).astype(np.int64), BINS)
+    p_values = survival[ale_bins]
+    threshold = p_uncorrected if p_uncorrected is not None else fdr_threshold(p_values, q)
+    significant = (p_values <= threshold) & (ale_values > 0)
+
+    # z for each histogram bin once, rather than for every voxel
+    normal = NormalDist()
+    z_bins = np.array([-normal.inv_cdf(max(p, 1e-300)) if p < 1.0 else 0.0 for p in survival.tolist()])
+    z_values = z_bins[ale_bins]
+
+    def full(values, fill):
+        grid_values = np.full(grid.shape, fill, dtype=np.float64)
+        grid_values[grid.mask] = values
+        return grid_values
+
+    significant_map = np.zeros(grid.shape, dtype=bool)
+    significant_map[grid.mask] = significant
+    return {'ale': full(ale_values, 0.0), 'p': full(p_values, 1.0), 'z': full(z_values, 0.0),
+            'threshold': threshold, 'significant': significant_map,
+            'experiments': len(experiments), 'foci': sum(len(ijk) for ijk, _ in experiments.values())}
+
+
+def save_ale(result, grid, filename):
+    maps = {name: result[name].astype(np.float32) for name in ('ale', 'p', 'z', 'difference') if name in result}
+    np.savez_compressed(filename, significant=result['significant'], affine=grid.affine, mask=grid.mask,
+                        threshold=result['threshold'], **maps)
+
+
+def peaks(result, grid, n=10):
+    # the n significant voxels with the highest ALE, as (x, y, z, ALE, z) in MNI mm
+    ale_values = np.where(result['significant'], result['ale'], 0.0).ravel()
+    top = [i for i in np.argsort(ale_values)[::-1][:n] if ale_values[i] > 0]
+    ijk = np.array(np.unravel_index(np.array(top, dtype=np.intp), grid.shape)).T
+    xyz = ijk * grid.voxel_size + MNI_ORIGIN
+    return [(x, y, z, float(result['ale'].flat[i]), float(result['z'].flat[i])) for (x, y, z), i in zip(xyz.tolist(), top)]
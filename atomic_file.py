@@ -0,0 +1,19 @@
+# Purpose:
+# Write a file so that an interrupted run never leaves a broken one behind (caches, checkpoints, state files):
+# the content goes to a temporary file next to it, which then replaces the file in one step with os.replace.
+
+import os
+
+
+def atomic_write(filename, write):
+    # write(temp_filename) writes the content;  the temporary file keeps filename's extension,
+    # since np.save and np.savez add theirs otherwise.  If writing fails, the temporary file is removed
+    root, ext = os.path.splitext(filename)
+    temp_filename = root + '.tmp' + ext
+    try:
+        write(temp_filename)
+        os.replace(temp_filename, filename)
+    except BaseException:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+        raise
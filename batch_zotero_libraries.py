@@ -0,0 +1,116 @@
+# Purpose:
+# Batch mode:  run import_zotero_xml_output_all.py on many Zotero exports at once
+# (e.g. separate reviews per construct - resilience, reserve, hardiness), instead of running the script
+# serially by hand with edited globals.
+#
+# Each library is processed by its own python process, in parallel, with its own output directory under the output root:
+#   output_root/<library name>/rois_*.txt, dictionary_inclusion_exclusion.tsv, summary.json, log.txt
+# and the per-library summaries are merged into output_root/summary.tsv and output_root/summary.json
+#
+# usage:
+#   python batch_zotero_libraries.py output_root export1.xml export2.xml ...
+#   python batch_zotero_libraries.py output_root "exports/*.xml" --workers 4     (globs are expanded here, also on Windows)
+
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'import_zotero_xml_output_all.py')
+
+
+def expand_exports(patterns):
+    # expand globs, keep the order given, and drop repeats
+    xml_filenames = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        xml_filenames += [os.path.abspath(match) for match in matches]
+    return list(dict.fromkeys(xml_filenames))
+
+
+def library_directories(xml_filenames, output_root):
+    # one output directory per library, named after the export (with a number added if two exports share a name)
+    dirs = []
+    used = set()
+    for xml_filename in xml_filenames:
+        name = os.path.splitext(os.path.basename(xml_filename))[0]
+        candidate = name
+        i = 2
+        while candidate in used:
+            candidate = name + '_' + str(i)
+            i += 1
+        used.add(candidate)
+        dirs.append(os.path.join(output_root, candidate))
+    return dirs
+
+
+def process_library(xml_filename, dir_output):
+    # runs the script in its own process;  its printed output goes to log.txt in the library's output directory
+    os.makedirs(dir_output, exist_ok=True)
+    start = time.perf_counter()
+    with open(os.path.join(dir_output, 'log.txt'), 'w', encoding='utf-8') as log:
+        completed = subprocess.run([sys.executable, SCRIPT, xml_filename, dir_output], stdout=log, stderr=subprocess.STDOUT)
+    result = {'library': os.path.basename(dir_output), 'xml_filename': xml_filename, 'dir_output': dir_output,
+              'returncode': completed.returncode, 'seconds': round(time.perf_counter() - start, 3)}
+    file_summary = os.path.join(dir_output, 'summary.json')
+    if completed.returncode == 0 and os.path.exists(file_summary):
+        with open(file_summary) as f:
+            result['summary'] = json.load(f)
+    return result
+
+
+def run_batch(patterns, output_root, workers=None):
+    xml_filenames = expand_exports(patterns)
+    output_root = os.path.abspath(output_root)
+    dirs = library_directories(xml_filenames, output_root)
+    os.makedirs(output_root, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    # threads only wait on the per-library processes, so the libraries really run in parallel
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(process_library, xml_filenames, dirs))
+    write_summary(results, output_root)
+    return results
+
+
+def write_summary(results, output_root):
+    # merged summary:  one row per library, plus the full per-library summaries as json
+    with open(os.path.join(output_root, 'summary.json'), 'w') as f:
+        json.dump(results, f, indent=2)
+
+    categories = []
+    for result in results:
+        for category in result.get('summary', {}).get('exclusion_categories', {}):
+            if category not in categories:
+                categories.append(category)
+
+    header = ['library', 'status', 'seconds', 'articles', 'included', 'excluded', 'resilience foci', 'susceptibility foci'] + categories
+    with open(os.path.join(output_root, 'summary.tsv'), 'w') as f:
+        f.write('\t'.join(header) + '\n')
+        for result in results:
+            summary = result.get('summary', {})
+            roifiles = summary.get('roifiles', {})
+            row = [result['library'], 'ok' if result['returncode'] == 0 else 'failed (see log.txt)', str(result['seconds']),
+                   str(summary.get('articles', '')), str(summary.get('included', '')), str(summary.get('excluded', '')),
+                   str(roifiles.get('rois_resilience.txt', {}).get('foci', '')),
+                   str(roifiles.get('rois_susceptibility.txt', {}).get('foci', ''))]
+            row += [str(summary.get('exclusion_categories', {}).get(category, '')) for category in categories]
+            f.write('\t'.join(row) + '\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the Zotero -> Sleuth/GingerALE extraction on many libraries in parallel')
+    parser.add_argument('output_root', help='directory for the per-library output directories and merged summary')
+    parser.add_argument('exports', nargs='+', help='Zotero xml exports (globs allowed)')
+    parser.add_argument('--workers', type=int, default=None, help='number of libraries processed at once (default: number of CPUs)')
+    args = parser.parse_args()
+
+    results = run_batch(args.exports, args.output_root, workers=args.workers)
+    for result in results:
+        status = 'ok' if result['returncode'] == 0 else 'FAILED'
+        print(result['library'] + '\t' + status + '\t' + str(result['seconds']) + ' s\t' + result['dir_output'])
+    if any(result['returncode'] != 0 for result in results):
+        sys.exit(1)
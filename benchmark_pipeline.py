@@ -0,0 +1,98 @@
+# Purpose:
+# Benchmark of the Zotero -> Sleuth/GingerALE pipeline on synthetic libraries of increasing size
+# (see synthetic_library.py), timing each stage with PipelineStats (see pipeline_stats.py).
+# Used to check how the pipeline scales and to catch regressions as it is optimized.
+#
+# Each size runs in its own python process, so peak memory is measured per size.
+# Generated libraries are kept in the work directory and re-used by later runs with the same settings.
+#
+# usage:
+#   python benchmark_pipeline.py                                   (1k, 10k and 100k records)
+#   python benchmark_pipeline.py --sizes 1000 1000000 --streaming --workers 4 --json bench.json
+#   python benchmark_pipeline.py --foci 20 --notes 10 --nbsp 0.5   (longer notes, more foci, more &nbsp; noise)
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from synthetic_library import write_library
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def library_filename(work_dir, records, seed, foci, notes, nbsp):
+    return os.path.join(work_dir, 'synthetic_%d_s%d_f%d_n%d_nbsp%g.xml' % (records, seed, foci, notes, nbsp))
+
+
+def run_one(xml_filename, dir_output, streaming, workers):
+    # runs in the benchmark's child process:  the full pipeline, with its printed output discarded
+    sys.path.insert(0, HERE)
+    import import_zotero_xml_output_all as pipeline
+    from pipeline_stats import PipelineStats
+
+    pipeline.streaming = streaming
+    pipeline.workers = workers
+    stats = PipelineStats()
+    stdout = sys.stdout
+    with open(os.devnull, 'w') as devnull:
+        sys.stdout = devnull
+        try:
+            pipeline.run(xml_filename, dir_output, stats=stats)
+        finally:
+            sys.stdout = stdout
+    json.dump(stats.as_dict(), sys.stdout)
+
+
+def benchmark(sizes, work_dir, seed=1, foci=8, notes=0, nbsp=0.1, streaming=False, workers=1):
+    rows = []
+    for records in sizes:
+        xml_filename = library_filename(work_dir, records, seed, foci, notes, nbsp)
+        if not os.path.exists(xml_filename):
+            write_library(xml_filename, records, seed=seed, foci=foci, notes=notes, nbsp=nbsp)
+        dir_output = os.path.join(work_dir, 'output_%d' % records)
+        os.makedirs(dir_output, exist_ok=True)
+        completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--run-one', xml_filename, dir_output,
+                                    '--workers', str(workers)] + (['--streaming'] if streaming else []),
+                                   stdout=subprocess.PIPE, check=True)
+        stats = json.loads(completed.stdout)
+        stats['records'] = records
+        stats['megabytes'] = round(os.path.getsize(xml_filename) / 2 ** 20, 1)
+        rows.append(stats)
+        print_row(stats)
+    return rows
+
+
+def print_row(stats):
+    stages = '  '.join('%s %.2fs' % (name, stage['wall']) for name, stage in stats['stages'].items())
+    print('%9d records  %7.1f MB  %7.2f s  %9s records/s  %7s MB peak  |  %s'
+          % (stats['records'], stats['megabytes'], stats['wall'], stats['records_per_s'], stats['peak_memory_mb'], stages))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time each pipeline stage on synthetic Zotero libraries')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000], help='numbers of records')
+    parser.add_argument('--work-dir', default=os.path.join(tempfile.gettempdir(), 'zotero_benchmark'),
+                        help='where generated libraries and outputs are kept')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--foci', type=int, default=8, help='largest number of foci per coordinate block')
+    parser.add_argument('--notes', type=int, default=0, help='extra free-text lines per record')
+    parser.add_argument('--nbsp', type=float, default=0.1, help='fraction of lines using &nbsp; instead of spaces')
+    parser.add_argument('--streaming', action='store_true')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--json', help='also save all results to this json file')
+    parser.add_argument('--run-one', nargs=2, metavar=('XML', 'DIR_OUTPUT'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        run_one(args.run_one[0], args.run_one[1], args.streaming, args.workers)
+        sys.exit(0)
+
+    os.makedirs(args.work_dir, exist_ok=True)
+    rows = benchmark(args.sizes, args.work_dir, seed=args.seed, foci=args.foci, notes=args.notes, nbsp=args.nbsp,
+                     streaming=args.streaming, workers=args.workers)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(rows, f, indent=2)
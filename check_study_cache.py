@@ -0,0 +1,47 @@
+# Purpose:
+# Offline check of the study cache (see study_cache.py) on a synthetic library (see synthetic_library.py):
+# serial and parallel extraction give the same studies, cold or warm, and every run - serial or parallel,
+# all misses or all hits - saves every record to the cache, so the next run doesn't re-extract anything.
+#
+# usage:
+#   python check_study_cache.py [--records 3000] [--workers 2]
+
+import argparse
+import os
+import pickle
+import tempfile
+
+from study_cache import StudyCache
+from synthetic_library import write_library
+from zotero_studies import iter_studies
+
+
+def cached_records(cache_filename):
+    with open(cache_filename, 'rb') as f:
+        return len(pickle.load(f)['studies'])
+
+
+def check(records=3000, workers=2):
+    with tempfile.TemporaryDirectory() as work_dir:
+        xml_filename = write_library(os.path.join(work_dir, 'library.xml'), records)
+        cache_filename = os.path.join(work_dir, 'study_cache.pickle')
+        expected = list(iter_studies(xml_filename))
+        # cold serial, warm parallel, warm serial, warm parallel again
+        for run, run_workers in enumerate([1, workers, 1, workers]):
+            cache = StudyCache(cache_filename)
+            studies = list(iter_studies(xml_filename, cache=cache, workers=run_workers))
+            cache.save()
+            assert studies == expected, 'run %d (workers=%d): studies differ from an uncached run' % (run, run_workers)
+            assert cached_records(cache_filename) == records, \
+                'run %d (workers=%d): cache saved %d of %d records' % (run, run_workers, cached_records(cache_filename), records)
+            if run > 0:
+                assert cache.misses == 0, 'run %d (workers=%d): %d records re-extracted' % (run, run_workers, cache.misses)
+    print('study cache OK (%d records, %d workers)' % (records, workers))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check the study cache with serial and parallel extraction')
+    parser.add_argument('--records', type=int, default=3000)
+    parser.add_argument('--workers', type=int, default=2)
+    args = parser.parse_args()
+    check(args.records, args.workers)
@@ -0,0 +1,99 @@
+# Purpose:
+# Offline check of pulling the library from the Zotero API (see zotero_local_api.py), against the local stand-in
+# (see zotero_api_standin.py) serving a synthetic library (see synthetic_library.py):
+#   - a first pull gives the same output files as reading the xml export
+#   - a second pull with nothing changed is a 304 (no items downloaded, nothing re-extracted)
+#   - after editing a note, trashing an item and deleting another, the next pull only downloads those changes
+#     (?since=, /deleted), and gives the same output files as a fresh pull of the changed library
+#   - the same, with the stand-in's /deleted switched off (deletions found from the list of keys instead)
+#
+# usage:
+#   python check_zotero_api.py [--records 1000]
+
+import argparse
+import contextlib
+import filecmp
+import io
+import os
+import tempfile
+
+import import_zotero_xml_output_all as pipeline
+from synthetic_library import write_library
+from zotero_api_standin import PREFIX, StandinHandler, StandinLibrary, serve
+
+
+def run(source, dir_output, url=None):
+    # the full pipeline, from the xml export (url None) or from the API;  returns its printed output
+    os.makedirs(dir_output, exist_ok=True)
+    pipeline.zotero_api_url = url
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        pipeline.run(source, dir_output)
+    return log.getvalue()
+
+
+def different_outputs(dir_a, dir_b):
+    # output files that differ or are missing;  the summary names the source, and the state file is the API's own
+    ignore = ['summary.json', pipeline.zotero_api_state_file]
+    comparison = filecmp.dircmp(dir_a, dir_b, ignore=ignore)
+    return comparison.diff_files + comparison.left_only + comparison.right_only
+
+
+def api_line(log):
+    return [line for line in log.split('\n') if line.startswith('Zotero API:')][0]
+
+
+class NoDeletedHandler(StandinHandler):
+    # a stand-in without /deleted, like older versions of the local API
+
+    def do_GET(self):
+        if self.path.startswith(PREFIX + '/deleted'):
+            self.send(404, b'Not found', 'text/plain')
+        else:
+            super().do_GET()
+
+
+def check_incremental(xml_filename, work_dir, handler=StandinHandler):
+    library = StandinLibrary.from_xml(xml_filename)
+    server, url = serve(library, handler=handler)
+    try:
+        run(xml_filename, os.path.join(work_dir, 'xml'))
+        dir_api = os.path.join(work_dir, 'api')
+        run(xml_filename, dir_api, url)
+        assert different_outputs(os.path.join(work_dir, 'xml'), dir_api) == [], 'pulled library differs from the xml export'
+
+        log = run(xml_filename, dir_api, url)
+        assert ' 0 changed since the last pull' in api_line(log), 'unchanged library was downloaded again:  ' + api_line(log)
+
+        items = [key for key, data in library.objects.items() if data['itemType'] != 'note']
+        notes = [key for key, data in library.objects.items() if data['itemType'] == 'note']
+        library.set_note(notes[3], ['1st keep', '4th disease PTSD', 'N=20', '4th resilience MNI', 'roi 1 2 3'])
+        library.trash(items[5])
+        changed = 3 + len(library.children(items[6]))  # deleting an item deletes its notes too
+        library.delete(items[6])
+        log = run(xml_filename, dir_api, url)
+        assert ' ' + str(changed) + ' changed since the last pull' in api_line(log), \
+            'expected ' + str(changed) + ' changes:  ' + api_line(log)
+        assert ': ' + str(len(items) - 2) + ' items,' in api_line(log), 'trashed or deleted item still there:  ' + api_line(log)
+
+        dir_fresh = os.path.join(work_dir, 'fresh')
+        run(xml_filename, dir_fresh, url)
+        assert different_outputs(dir_fresh, dir_api) == [], 'incremental pull differs from a fresh pull'
+    finally:
+        server.shutdown()
+        pipeline.zotero_api_url = None
+
+
+def check(records=1000):
+    with tempfile.TemporaryDirectory() as work_dir:
+        xml_filename = write_library(os.path.join(work_dir, 'library.xml'), records)
+        check_incremental(xml_filename, os.path.join(work_dir, 'deleted'))
+        check_incremental(xml_filename, os.path.join(work_dir, 'keys'), handler=NoDeletedHandler)
+    print('Zotero API OK (%d records)' % records)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check pulling the library from a local stand-in of the Zotero API')
+    parser.add_argument('--records', type=int, default=1000)
+    args = parser.parse_args()
+    check(args.records)
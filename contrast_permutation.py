@@ -0,0 +1,131 @@
+# Purpose:
+# Permutation test for disorder contrasts (e.g. resilience in PTSD vs. SZ), the step GingerALE runs on the pooled
+# rois_*_combined_* files:  the experiments of both disorders are pooled, randomly re-split into two groups of the
+# original sizes, and the difference of the two groups' ALE maps is compared with the observed difference.
+#
+# Every experiment's MA map is computed once (see ale.py), as log(1 - MA) over the voxels any experiment touches, so
+#   ALE_A - ALE_B = exp(sum of log(1 - MA) over B) - exp(sum over A)
+# and a batch of permutations is one matrix product (group indicators x log(1 - MA)).
+# Batches run across a process pool, each with its own random stream derived from the seed and the batch number,
+# so results are the same for any number of workers.  Finished batches are checkpointed, so long runs
+# (10k permutations x every pair x both factors) can be interrupted and resumed.
+#
+# Note, needs numpy
+
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from ale import ma_map
+from atomic_file import atomic_write
+from zotero_studies import process_pool_context
+
+BATCH = 100  # permutations per batch (and per checkpoint)
+
+# set in each worker process (inherited when forked, else sent once by the pool initializer)
+_log_complement = None
+
+
+def _init_worker(log_complement):
+    global _log_complement
+    _log_complement = log_complement
+
+
+def permutation_batch(batch, seed, n_a, n_permutations, observed):
+    # counts, per voxel, of permuted differences at least as large as observed, in each direction
+    n_experiments = _log_complement.shape[0]
+    size = min(BATCH, n_permutations - batch * BATCH)
+    rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(batch,)))
+    groups = np.zeros((size, n_experiments))
+    order = np.argsort(rng.random((size, n_experiments)), axis=1)
+    np.put_along_axis(groups, order[:, :n_a], 1.0, axis=1)
+    sum_a = groups @ _log_complement
+    sum_b = _log_complement.sum(axis=0) - sum_a
+    difference = np.exp(sum_b) - np.exp(sum_a)
+    return batch, (difference >= observed).sum(axis=0), (difference <= observed).sum(axis=0)
+
+
+def contrast_key(experiments_a, experiments_b, seed, n_permutations, grid):
+    # identifies a contrast run, so a checkpoint is only resumed for the very same analysis
+    digest = hashlib.sha1()
+    for experiments in (experiments_a, experiments_b):
+        for experiment, (ijk, N) in sorted(experiments.items()):
+            digest.update(repr((experiment, N, ijk.tolist())).encode())
+    digest.update(repr((seed, n_permutations, BATCH, grid.voxel_size, int(grid.mask.sum()))).encode())
+    return digest.hexdigest()
+
+
+def load_checkpoint(filename, key, n_voxels):
+    if filename is not None and os.path.exists(filename):
+        with np.load(filename) as data:
+            if str(data['key']) == key:
+                return set(data['done'].tolist()), data['greater'].copy(), data['less'].copy()
+    return set(), np.zeros(n_voxels, dtype=np.int64), np.zeros(n_voxels, dtype=np.int64)
+
+
+def save_checkpoint(filename, key, done, greater, less):
+    atomic_write(filename, lambda temp_filename: np.savez(temp_filename, key=key, done=np.array(sorted(done), dtype=np.int64),
+                                                          greater=greater, less=less))
+
+
+def contrast_test(experiments_a, experiments_b, grid, n_permutations=10000, seed=0, workers=1, checkpoint=None, ma_maps=None):
+    # experiments_a, experiments_b:  {experiment: (foci voxel indices, N)} of the two disorders, see ale.experiment_foci.
+    # Returns the observed difference map (ALE_A - ALE_B) and, per voxel, p-values for A > B and B > A
+    # (grid shape;  1 where no experiment has any modelled activation)
+    experiments = list(experiments_a.items()) + list(experiments_b.items())
+    n_voxels = int(grid.mask.sum())
+    if len(experiments) == 0:
+        # both pools empty:  no difference anywhere, p = 1 everywhere
+        return {'difference': np.zeros(grid.shape), 'p_greater': np.ones(grid.shape), 'p_less': np.ones(grid.shape),
+                'permutations': n_permutations, 'seed': seed}
+    ma = np.array([(ma_maps(experiment, ijk, N) if ma_maps is not None else ma_map(ijk, N, grid))[grid.mask]
+                   for experiment, (ijk, N) in experiments], dtype=np.float32)
+    support = np.flatnonzero((ma > 0).any(axis=0))
+    log_complement = np.log1p(-ma[:, support].astype(np.float64))
+    del ma
+    n_a = len(experiments_a)
+    observed = np.exp(log_complement[n_a:].sum(axis=0)) - np.exp(log_complement[:n_a].sum(axis=0))
+
+    key = contrast_key(experiments_a, experiments_b, seed, n_permutations, grid)
+    done, greater, less = load_checkpoint(checkpoint, key, len(support))
+    batches = [batch for batch in range(-(-n_permutations // BATCH)) if batch not in done]
+
+    def finished(batch, batch_greater, batch_less):
+        nonlocal greater, less
+        greater += batch_greater
+        less += batch_less
+        done.add(batch)
+        if checkpoint is not None:
+            save_checkpoint(checkpoint, key, done, greater, less)
+
+    if len(support) > 0 and len(batches) > 0:
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=process_pool_context(), initializer=_init_worker,
+                                     initargs=(log_complement,)) as executor:
+                futures = [executor.submit(permutation_batch, batch, seed, n_a, n_permutations, observed) for batch in batches]
+                for future in as_completed(futures):
+                    finished(*future.result())
+        else:
+            _init_worker(log_complement)
+            for batch in batches:
+                finished(*permutation_batch(batch, seed, n_a, n_permutations, observed))
+
+    def full(values, fill):
+        grid_values = np.full(grid.shape, fill, dtype=np.float64)
+        masked = np.full(n_voxels, fill, dtype=np.float64)
+        masked[support] = values
+        grid_values[grid.mask] = masked
+        return grid_values
+
+    return {'difference': full(observed, 0.0),
+            'p_greater': full((greater + 1) / (n_permutations + 1), 1.0),
+            'p_less': full((less + 1) / (n_permutations + 1), 1.0),
+            'permutations': n_permutations, 'seed': seed}
+
+
+def save_contrast(result, grid, filename):
+    np.savez_compressed(filename, difference=result['difference'].astype(np.float32),
+                        p_greater=result['p_greater'].astype(np.float32), p_less=result['p_less'].astype(np.float32),
+                        affine=grid.affine, mask=grid.mask, permutations=result['permutations'], seed=result['seed'])
@@ -0,0 +1,141 @@
+# Purpose:
+# Compact NumPy-backed table of every extracted focus, so later analyses (pooling, contrasts, QA)
+# can run as array operations instead of re-parsing the Sleuth/GingerALE text files.
+#
+# One row per focus:  x, y, z (float32), experiment, study, space, factor and disorder.
+# An experiment is one coordinate block as written to the Sleuth file (// Reference, // Author Year, // Subjects=N),
+# so experiment_N and experiment_label have one entry per block.
+# The table is saved to (and loaded from) a single .npz file.
+#
+# Note, needs numpy (only imported when the coordinate store is used)
+
+import re
+from array import array
+
+import numpy as np
+
+from zotero_studies import DISORDERS, FACTORS
+
+# integer codes used in the space, factor and disorder columns
+SPACES = ['MNI', 'Talairach']
+FACTOR_NAMES = list(FACTORS)
+POOLS = [''] + DISORDERS  # '' means not in any disorder pool
+
+COLUMNS = ['x', 'y', 'z', 'experiment', 'study', 'space', 'factor', 'disorder']
+EXPERIMENT_COLUMNS = ['experiment_N', 'experiment_label']
+
+
+def parse_coordinate(token):
+    # coordinates are typed by hand in the notes;  anything that isn't a number becomes NaN (see foci QA)
+    try:
+        return float(token)
+    except ValueError:
+        return float('nan')
+
+
+def parse_sample_size(N):
+    # N=xxx is free text in the notes (e.g. '45', '45&nbsp;', '30 (15 patients)');  take the leading number, else 0
+    match = re.match(r'\s*(\d+)', str(N))
+    return int(match.group(1)) if match else 0
+
+
+class CoordinateTableBuilder:
+    # Accumulates foci study by study (e.g. inside the streaming extraction loop) in compact typed arrays
+
+    def __init__(self):
+        self.columns = {
+            'x': array('f'), 'y': array('f'), 'z': array('f'),
+            'experiment': array('i'), 'study': array('i'),
+            'space': array('b'), 'factor': array('b'), 'disorder': array('b'),
+        }
+        self.experiment_N = array('i')
+        self.experiment_label = []
+        self.n_studies = 0
+
+    def add_study(self, study):
+        study_index = self.n_studies
+        self.n_studies += 1
+        N = parse_sample_size(study.N)
+        label = str(study.author) + ' ' + str(study.year)
+        columns = self.columns
+        for factor_code, factor in enumerate(FACTOR_NAMES):
+            for block in getattr(study, factor):
+                experiment_index = len(self.experiment_N)
+                self.experiment_N.append(N)
+                self.experiment_label.append(label)
+                space_code = SPACES.index(block.reference)
+                disorder_code = POOLS.index(block.pool)
+                for x, y, z in block.coordinates:
+                    columns['x'].append(parse_coordinate(x))
+                    columns['y'].append(parse_coordinate(y))
+                    columns['z'].append(parse_coordinate(z))
+                    columns['experiment'].append(experiment_index)
+                    columns['study'].append(study_index)
+                    columns['space'].append(space_code)
+                    columns['factor'].append(factor_code)
+                    columns['disorder'].append(disorder_code)
+        return study
+
+    def build(self):
+        arrays = {name: np.array(values) for name, values in self.columns.items()}
+        arrays['experiment_N'] = np.asarray(self.experiment_N, dtype=np.int32)
+        arrays['experiment_label'] = np.asarray(self.experiment_label, dtype=str)
+        return CoordinateTable(**arrays)
+
+
+class CoordinateTable:
+
+    def __init__(self, x, y, z, experiment, study, space, factor, disorder, experiment_N, experiment_label):
+        self.x = np.ascontiguousarray(x, dtype=np.float32)
+        self.y = np.ascontiguousarray(y, dtype=np.float32)
+        self.z = np.ascontiguousarray(z, dtype=np.float32)
+        self.experiment = np.ascontiguousarray(experiment, dtype=np.int32)
+        self.study = np.ascontiguousarray(study, dtype=np.int32)
+        self.space = np.ascontiguousarray(space, dtype=np.int8)
+        self.factor = np.ascontiguousarray(factor, dtype=np.int8)
+        self.disorder = np.ascontiguousarray(disorder, dtype=np.int8)
+        # per experiment (coordinate block)
+        self.experiment_N = np.ascontiguousarray(experiment_N, dtype=np.int32)
+        self.experiment_label = np.asarray(experiment_label, dtype=str)
+
+    @classmethod
+    def from_studies(cls, studies):
+        builder = CoordinateTableBuilder()
+        for study in studies:
+            builder.add_study(study)
+        return builder.build()
+
+    def __len__(self):
+        return len(self.x)
+
+    @property
+    def xyz(self):
+        # (n, 3) float32 array of all foci
+        return np.column_stack((self.x, self.y, self.z))
+
+    def mask(self, factor=None, disorder=None, space=None):
+        # boolean row mask, e.g. table.mask(factor='resilience', disorder=['PTSD', 'MDD'])
+        keep = np.ones(len(self), dtype=bool)
+        for column, codes, value in ((self.factor, FACTOR_NAMES, factor), (self.disorder, POOLS, disorder), (self.space, SPACES, space)):
+            if value is None:
+                continue
+            values = [value] if isinstance(value, str) else value
+            keep &= np.isin(column, [codes.index(v) for v in values])
+        return keep
+
+    def subset(self, mask):
+        # rows selected by mask;  experiment and study indices (and per-experiment columns) are left as they are
+        return CoordinateTable(self.x[mask], self.y[mask], self.z[mask], self.experiment[mask], self.study[mask],
+                               self.space[mask], self.factor[mask], self.disorder[mask],
+                               self.experiment_N, self.experiment_label)
+
+    def select(self, factor=None, disorder=None, space=None):
+        return self.subset(self.mask(factor=factor, disorder=disorder, space=space))
+
+    def save(self, filename):
+        np.savez(filename, **{name: getattr(self, name) for name in COLUMNS + EXPERIMENT_COLUMNS})
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as data:
+            return cls(**{name: data[name] for name in COLUMNS + EXPERIMENT_COLUMNS})
@@ -0,0 +1,57 @@
+# Purpose:
+# Convert foci between Talairach and MNI space in one batched matrix transform over the whole coordinate table,
+# so pooled Sleuth/GingerALE files can be written in a single space instead of leaving mixed-space pools
+# for GingerALE to handle study by study.
+#
+# Transforms are the Lancaster et al. (2007) icbm2tal affine transforms (as used by GingerALE/BrainMap).
+# MNI -> Talairach uses the matrix for the template the study used (SPM, FSL, or the pooled "other" estimate);
+# Talairach -> MNI uses its inverse.  Since the notes don't record the software, the pooled transform is the default.
+#
+# Note, needs numpy
+
+import numpy as np
+
+from coordinate_store import SPACES, CoordinateTable
+
+ICBM2TAL = {
+    'spm': np.array([[0.9254, 0.0024, -0.0118, -1.0207],
+                     [-0.0048, 0.9316, -0.0871, -1.7667],
+                     [0.0152, 0.0883, 0.8924, 4.0926],
+                     [0.0, 0.0, 0.0, 1.0]]),
+    'fsl': np.array([[0.9464, 0.0034, -0.0026, -1.0680],
+                     [-0.0083, 0.9479, -0.0580, -1.0239],
+                     [0.0053, 0.0617, 0.9010, 3.1883],
+                     [0.0, 0.0, 0.0, 1.0]]),
+    'pooled': np.array([[0.9357, 0.0029, -0.0072, -1.0423],
+                        [-0.0065, 0.9396, -0.0726, -1.3940],
+                        [0.0103, 0.0752, 0.8967, 3.6475],
+                        [0.0, 0.0, 0.0, 1.0]]),
+}
+
+
+def affine_transform(xyz, matrix):
+    # apply a 4x4 affine to an (n, 3) array of coordinates in one matrix multiply
+    xyz = np.asarray(xyz, dtype=np.float64)
+    return xyz @ matrix[:3, :3].T + matrix[:3, 3]
+
+
+def mni_to_talairach(xyz, template='pooled'):
+    return affine_transform(xyz, ICBM2TAL[template])
+
+
+def talairach_to_mni(xyz, template='pooled'):
+    return affine_transform(xyz, np.linalg.inv(ICBM2TAL[template]))
+
+
+def convert_space(table, target='MNI', template='pooled'):
+    # returns a new CoordinateTable with every focus in target space ('MNI' or 'Talairach')
+    target_code = SPACES.index(target)
+    xyz = table.xyz.astype(np.float64)
+    to_convert = table.space != target_code
+    if target == 'MNI':
+        xyz[to_convert] = talairach_to_mni(xyz[to_convert], template)
+    else:
+        xyz[to_convert] = mni_to_talairach(xyz[to_convert], template)
+    return CoordinateTable(xyz[:, 0], xyz[:, 1], xyz[:, 2], table.experiment, table.study,
+                           np.full(len(table), target_code, dtype=np.int8), table.factor, table.disorder,
+                           table.experiment_N, table.experiment_label)
@@ -0,0 +1,205 @@
+# Purpose:
+# Find duplicate and near-duplicate records in a (merged) library, e.g. the same article found by the first-pass
+# and the grey-literature searches, so its foci aren't counted twice in the ALE.
+#
+# dict_title only counted exact 'author year title' strings.  Here records are grouped when they have
+#   - the same title after normalizing (case, punctuation, accents, whitespace) and the same first author,
+#   - nearly the same title (Jaccard similarity of character 4-grams >= threshold, e.g. typos or changed words),
+#     the same numbers in the title ('study 1' vs 'study 2' are different articles) and the same first author;
+#     candidate pairs come from MinHash signatures with LSH banding (banded by author and numbers too),
+#     so only titles sharing a band are ever compared (near-linear in the number of records),
+#   - the same main title (before a ':' or ' - ' subtitle) and the same first author,
+#   - exactly the same set of foci (any author or title).
+# Records are only flagged (duplicate_records.tsv and a printed warning), never dropped from the outputs.
+#
+# Note, needs numpy (only imported when duplicate detection is used)
+
+import hashlib
+import re
+import unicodedata
+import zlib
+
+import numpy as np
+
+from coordinate_store import parse_coordinate
+from zotero_studies import FACTORS
+
+SHINGLE = 4  # characters per title shingle
+NUM_PERM = 128  # MinHash signature length
+BANDS = 16  # LSH bands of NUM_PERM // BANDS rows:  pairs above ~0.7 similarity are likely to share a band
+PRIME = (1 << 32) + 15  # hashes are 32 bit (crc32), so (a * h + b) stays within uint64 for a < 2**29
+
+
+def normalize_text(text):
+    # casefold, strip accents and punctuation, collapse whitespace
+    if text is None:
+        return ''
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    text = re.sub(r'[^\w\s]', ' ', text.casefold())
+    return ' '.join(text.split())
+
+
+def main_title(title):
+    # title without its subtitle, normalized;  '' if there is no subtitle or the main title is too short to go on
+    if title is None:
+        return ''
+    main = re.split(r':| - | \u2013 ', title, maxsplit=1)
+    if len(main) == 1:
+        return ''
+    main = normalize_text(main[0])
+    return main if len(main.split()) >= 3 else ''
+
+
+def title_shingles(normalized_title):
+    if len(normalized_title) <= SHINGLE:
+        return {normalized_title} if normalized_title else set()
+    return {normalized_title[i:i + SHINGLE] for i in range(len(normalized_title) - SHINGLE + 1)}
+
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+
+def foci_digest(study):
+    # hash of the study's foci (as numbers, in any order), per factor;  None if the study has no foci
+    foci = []
+    for factor in FACTORS:
+        for block in getattr(study, factor):
+            foci += [(factor,) + tuple(round(parse_coordinate(token), 1) for token in xyz) for xyz in block.coordinates]
+    if not foci:
+        return None
+    return hashlib.sha1(repr(sorted(foci)).encode()).hexdigest()
+
+
+class MinHasher:
+
+    def __init__(self, num_perm=NUM_PERM, seed=1):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, 1 << 29, size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, 1 << 32, size=num_perm, dtype=np.uint64)
+
+    def signature(self, shingles):
+        hashes = np.fromiter((zlib.crc32(shingle.encode('utf-8')) for shingle in shingles), dtype=np.uint64, count=len(shingles))
+        return ((np.outer(hashes, self.a) + self.b) % PRIME).min(axis=0)
+
+
+class DisjointSets:
+
+    def __init__(self, n):
+        self.parent = list(range(n))
+
+    def find(self, i):
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, i, j):
+        i, j = self.find(i), self.find(j)
+        if i != j:
+            self.parent[max(i, j)] = min(i, j)
+
+
+class DuplicateFinder:
+    # collects what's needed from each study (alongside the Sleuth/GingerALE output), then finds groups
+
+    def __init__(self, threshold=0.8, num_perm=NUM_PERM, bands=BANDS):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.records = []  # (rec_number, author, year, title) of each study
+        self.keys = []  # normalized (author, title)
+        self.main_titles = []  # normalized title without subtitle, if it has one
+        self.foci = []  # foci digest
+
+    def add_study(self, study):
+        self.records.append((study.rec_number, study.author, study.year, study.title))
+        self.keys.append((normalize_text(study.author), normalize_text(study.title)))
+        self.main_titles.append(main_title(study.title))
+        self.foci.append(foci_digest(study))
+        return study
+
+    def find(self):
+        # returns a list of groups, each a dict with the reasons ('same title', 'similar title', 'same foci')
+        # and the record indices (in the order the studies were added)
+        n = len(self.records)
+        groups = DisjointSets(n)
+        reasons = {}  # (i, j) linked record indices -> reason
+
+        def link(i, j, reason):
+            groups.union(i, j)
+            reasons.setdefault((i, j), reason)
+
+        # exact duplicates:  same normalized author and title
+        first = {}
+        for i, key in enumerate(self.keys):
+            if key[1] == '':
+                continue
+            if key in first:
+                link(first[key], i, 'same title')
+            else:
+                first[key] = i
+
+        # subtitle added or dropped:  main title of one is the whole title of the other (or both have the same main title)
+        first_main = {}
+        for i, (author, title) in enumerate(self.keys):
+            if self.main_titles[i] != '':
+                first_main.setdefault((author, self.main_titles[i]), i)
+        for i, key in enumerate(self.keys):
+            for lookup in (key, (key[0], self.main_titles[i])):
+                j = first_main.get(lookup)
+                if j is not None and j != i:
+                    link(min(i, j), max(i, j), 'similar title')
+
+        # near duplicates:  MinHash/LSH over the distinct (author, title) keys, verified on the exact shingle sets
+        distinct = list(first.items())
+        shingles = [title_shingles(key[1]) for key, _ in distinct]
+        hasher = MinHasher(self.num_perm)
+        rows = self.num_perm // self.bands
+        buckets = {}
+        for k, shingle_set in enumerate(shingles):
+            author, title = distinct[k][0]
+            numbers = tuple(token for token in title.split() if any(char.isdigit() for char in token))
+            signature = hasher.signature(shingle_set)
+            for band in range(self.bands):
+                buckets.setdefault((band, author, numbers, signature[band * rows:(band + 1) * rows].tobytes()), []).append(k)
+        compared = set()
+        for bucket in buckets.values():
+            for x in range(len(bucket)):
+                for y in range(x + 1, len(bucket)):
+                    k, l = bucket[x], bucket[y]
+                    if (k, l) in compared:
+                        continue
+                    compared.add((k, l))
+                    i, j = distinct[k][1], distinct[l][1]
+                    if jaccard(shingles[k], shingles[l]) >= self.threshold:
+                        link(i, j, 'similar title')
+
+        # identical sets of foci
+        first_foci = {}
+        for i, digest in enumerate(self.foci):
+            if digest is None:
+                continue
+            if digest in first_foci:
+                link(first_foci[digest], i, 'same foci')
+            else:
+                first_foci[digest] = i
+
+        members = {}
+        for i in range(n):
+            members.setdefault(groups.find(i), []).append(i)
+        group_reasons = {}
+        for (i, j), reason in reasons.items():
+            group_reasons.setdefault(groups.find(i), set()).add(reason)
+        return [{'reasons': sorted(group_reasons[root]), 'records': indices}
+                for root, indices in members.items() if len(indices) > 1]
+
+    def write(self, groups, filename):
+        # one row per record in a duplicate group
+        with open(filename, 'w', encoding='utf-8') as f:
+            f.write('group\treasons\trec-number\tauthor\tyear\ttitle\n')
+            for number, group in enumerate(groups, 1):
+                for i in group['records']:
+                    rec_number, author, year, title = self.records[i]
+                    f.write('\t'.join([str(number), ', '.join(group['reasons']), str(rec_number), str(author), str(year), str(title)]) + '\n')
@@ -0,0 +1,119 @@
+# Purpose:
+# Quality control of every extracted focus, as array operations over the whole CoordinateTable
+# (see coordinate_store.py), before the coordinates go into GingerALE.
+#
+# Coordinates are copied from the notes as typed, so this checks for
+#   - non-numeric tokens (NaN in the table)
+#   - foci outside the bounding box of the brain in their space, or outside a brain mask if one is given
+#   - likely sign errors:  outside the brain, but inside once the sign of y or z is flipped
+#   - the same focus listed twice in a study (same factor, same coordinates to 0.1 mm)
+#   - space consistency:  studies reporting in both MNI and Talairach, and 'Talairach' foci that only fit
+#     the (larger) MNI brain, i.e. probably MNI coordinates labelled as Talairach
+# and reports the number of problems per study.
+#
+# Note, needs numpy
+
+import numpy as np
+
+from coordinate_store import SPACES
+
+# bounding boxes (mm) of the brain:  MNI152 template extent, and the Talairach atlas brain (a bit smaller),
+# with a few mm to spare for smoothing and rounding.  (x, y, z) minimum and maximum
+BOUNDS = {
+    'MNI': (np.array([-92.0, -128.0, -74.0]), np.array([92.0, 92.0, 110.0])),
+    'Talairach': (np.array([-72.0, -106.0, -46.0]), np.array([72.0, 74.0, 80.0])),
+}
+CHECKS = ['not a number', 'outside brain', 'sign error?', 'duplicate', 'MNI labelled Talairach?']
+
+
+def load_brain_mask(filename):
+    # brain mask in MNI space, saved as .npz with 'mask' (3D boolean) and 'affine' (4x4, voxel -> mm)
+    with np.load(filename) as data:
+        return data['mask'].astype(bool), data['affine']
+
+
+def inside_box(xyz, space_codes):
+    inside = np.zeros(len(xyz), dtype=bool)
+    for code, space in enumerate(SPACES):
+        rows = space_codes == code
+        low, high = BOUNDS[space]
+        inside[rows] = np.all((xyz[rows] >= low) & (xyz[rows] <= high), axis=1)
+    return inside
+
+
+def inside_mask(xyz, mask, affine):
+    # nearest voxel of each focus in the mask;  foci off the mask's grid are outside
+    ijk = np.rint(np.c_[xyz, np.ones(len(xyz))] @ np.linalg.inv(affine).T)[:, :3]
+    on_grid = np.all((ijk >= 0) & (ijk < mask.shape), axis=1) & ~np.isnan(ijk).any(axis=1)
+    inside = np.zeros(len(xyz), dtype=bool)
+    i, j, k = ijk[on_grid].astype(int).T
+    inside[on_grid] = mask[i, j, k]
+    return inside
+
+
+def inside_brain(xyz, space_codes, brain_mask=None):
+    # bounding box for every focus;  the mask (MNI space) is applied to MNI foci on top of that
+    inside = inside_box(xyz, space_codes)
+    if brain_mask is not None:
+        mni = space_codes == SPACES.index('MNI')
+        inside[mni] &= inside_mask(xyz[mni], *brain_mask)
+    return inside
+
+
+def check_foci(table, brain_mask=None):
+    # one boolean array per check, one row per focus
+    xyz = table.xyz.astype(np.float64)
+    nan = np.isnan(xyz).any(axis=1)
+    inside = inside_brain(xyz, table.space, brain_mask)
+    outside = ~inside & ~nan
+
+    # flipping the sign of y or z brings the focus into the brain
+    sign = np.zeros(len(table), dtype=bool)
+    for axis in (1, 2):
+        flipped = xyz[outside].copy()
+        flipped[:, axis] *= -1
+        sign[np.flatnonzero(outside)[inside_brain(flipped, table.space[outside], brain_mask)]] = True
+
+    # same study, same factor, same focus (to 0.1 mm):  all but the first are duplicates
+    keys = np.c_[table.study, table.factor, np.rint(np.nan_to_num(xyz, nan=1e6) * 10)].astype(np.int64)
+    _, first = np.unique(keys, axis=0, return_index=True)
+    duplicate = np.ones(len(table), dtype=bool)
+    duplicate[first] = False
+    duplicate &= ~nan
+
+    # 'Talairach' foci that are outside the Talairach brain but inside the MNI one
+    talairach = table.space == SPACES.index('Talairach')
+    mni_fit = inside_box(xyz, np.full(len(table), SPACES.index('MNI'), dtype=table.space.dtype))
+    mislabelled = talairach & outside & mni_fit
+
+    return dict(zip(CHECKS, [nan, outside, sign, duplicate, mislabelled]))
+
+
+def study_report(table, checks):
+    # per study:  number of foci and of each problem, and whether it mixes spaces.  Only studies with foci
+    n_studies = int(table.study.max()) + 1 if len(table) > 0 else 0
+    report = {'study': np.arange(n_studies), 'foci': np.bincount(table.study, minlength=n_studies)}
+    for name, flags in checks.items():
+        report[name] = np.bincount(table.study, weights=flags, minlength=n_studies).astype(int)
+    spaces = np.zeros((n_studies, len(SPACES)), dtype=bool)
+    spaces[table.study, table.space] = True
+    report['mixed spaces'] = spaces.sum(axis=1) > 1
+    # label of each study from its first experiment
+    label = np.full(n_studies, '', dtype=table.experiment_label.dtype)
+    label[table.study[::-1]] = table.experiment_label[table.experiment[::-1]]
+    report['label'] = label
+    has_foci = report['foci'] > 0
+    return {name: values[has_foci] for name, values in report.items()}
+
+
+def write_report(report, filename):
+    # studies with at least one problem, one row each
+    columns = ['study', 'label', 'foci'] + CHECKS + ['mixed spaces']
+    problems = np.zeros(len(report['study']), dtype=bool)
+    for name in CHECKS + ['mixed spaces']:
+        problems |= report[name] > 0
+    with open(filename, 'w', encoding='utf-8') as f:
+        f.write('\t'.join(columns) + '\n')
+        for row in np.flatnonzero(problems):
+            f.write('\t'.join(str(report[name][row]) for name in columns) + '\n')
+    return int(problems.sum())
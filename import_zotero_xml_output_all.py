@@ -17,55 +17,137 @@
 # Filename was updated below and changes pushed to github.
 #
 # Copyright Andrew James PhD, 5-2-2024
+#
+# Update:  the pipeline is now a set of importable functions - importing this file has no side effects
+# (no os.chdir, no parsing, no file writes).  Run it as a script for the full pipeline, as before:
+#   python import_zotero_xml_output_all.py [xml_filename [dir_workspace]]
+# or use it as a library:
+#   studies = load_library(xml_filename)
+#   results = write_sleuth(studies, dir_output, roifiles)
+# numpy and the other optional pieces (coordinate store, space conversion, study cache) are only imported when used.
 
 ## Initializing
 
-# initialize code to read XML
-import urllib.request, urllib.parse, urllib.error
-import xml.etree.ElementTree as ET
-import ssl
-import sys
-from bs4 import BeautifulSoup
-#import lxml
+import json
 import os
+import sys
+from zotero_studies import extract_studies, iter_studies
+from sleuth_output import SleuthOutputs, contrast_pools
+from reason_index import ReasonIndex
+from pipeline_stats import PipelineStats, timed
+
 dir_workspace = 'A:\\People\\Andy James\\projects\\R01 Resiliency\\metaanalysis data\\workspace\\'
 dir_data = 'A:\\People\\Andy James\\projects\\R01 Resiliency\\metaanalysis data\\7 first pass and gray search combined\\'
 
-# go to workspace directory
-os.chdir(dir_workspace)
-
-# Ignore SSL certificate errors
-ctx = ssl.create_default_context()
-ctx.check_hostname = False
-ctx.verify_mode = ssl.CERT_NONE
-
-# declare XML file to read and Sleuth/GingerALE text output
+# declare XML file to read and Sleuth/GingerALE text output (relative to the workspace directory)
 #  note, hardcoded
 xml_filename = dir_data + 'Resilience_Systematic_Review.xml' # library was renamed for mansucript submission to be more specific;  filename updated here 9/4/2024
-roifile_res = './rois_resilience.txt'
-roifile_res_MDD = './rois_resilience_MDD.txt'
-roifile_res_PTSD = './rois_resilience_PTSD.txt'
-roifile_res_SZ = './rois_resilience_SZ.txt'
-roifile_res_BD = './rois_resilience_BD.txt'
-roifile_sus = './rois_susceptibility.txt'
-roifile_sus_MDD = './rois_susceptibility_MDD.txt'
-roifile_sus_PTSD = './rois_susceptibility_PTSD.txt'
-roifile_sus_SZ = './rois_susceptibility_SZ.txt'
-roifile_sus_BD = './rois_susceptibility_BD.txt'
-# declare empty strings for Major Depressive Disorder (MDD), PTSD, Schizophrenia (SZ) and Bipolar disorder (BD)
-str_res = ''
-str_res_MDD = ''
-str_res_PTSD = ''
-str_res_SZ = ''
-str_res_BD = ''
-str_sus = ''
-str_sus_MDD = ''
-str_sus_PTSD = ''
-str_sus_SZ = ''
-str_sus_BD = ''
-# counter for included articles that are excluded because coords not in MNI or TT space (e.g. Freesurfer atlases)
-count_exclude_nonMNIorTT_res = 0
-count_exclude_nonMNIorTT_sus = 0
+roifile_res = 'rois_resilience.txt'
+roifile_res_MDD = 'rois_resilience_MDD.txt'
+roifile_res_PTSD = 'rois_resilience_PTSD.txt'
+roifile_res_SZ = 'rois_resilience_SZ.txt'
+roifile_res_BD = 'rois_resilience_BD.txt'
+roifile_sus = 'rois_susceptibility.txt'
+roifile_sus_MDD = 'rois_susceptibility_MDD.txt'
+roifile_sus_PTSD = 'rois_susceptibility_PTSD.txt'
+roifile_sus_SZ = 'rois_susceptibility_SZ.txt'
+roifile_sus_BD = 'rois_susceptibility_BD.txt'
+# and group them by factor and disorder pool;  '' is the file with all studies for that factor
+roifiles = {
+    'resilience': {'': roifile_res, 'MDD': roifile_res_MDD, 'PTSD': roifile_res_PTSD, 'SZ': roifile_res_SZ, 'BD': roifile_res_BD},
+    'susceptibility': {'': roifile_sus, 'MDD': roifile_sus_MDD, 'PTSD': roifile_sus_PTSD, 'SZ': roifile_sus_SZ, 'BD': roifile_sus_BD},
+}
+# tsv file of reasons for inclusion or exclusion (supplemental materials in manuscript), and machine-readable summary of the run
+file_inclusion_exclusion = 'dictionary_inclusion_exclusion.tsv'
+file_summary = 'summary.json'
+# compact binary table (.npz) of all extracted foci for later analyses, see coordinate_store.py (needs numpy)
+#  set to None to skip
+coordinate_store_file = None # e.g. 'rois_coordinates.npz'
+# columnar catalog (.npz) with one row per record (included/excluded, disorders, foci counts, ...), every reason for
+#  inclusion or exclusion, and every focus, see study_catalog.py (needs numpy).  Set to None to skip
+study_catalog_file = None # e.g. 'study_catalog.npz'
+# tsv of possible duplicate records:  same or nearly the same title and first author, or the same set of foci,
+#  see duplicate_records.py (needs numpy).  Duplicates are only flagged, not removed.  Set to None to skip
+duplicates_file = None # e.g. 'duplicate_records.tsv'
+# quality control of every focus (non-numeric, outside the brain, sign errors, duplicates within a study, space
+#  consistency), one row per study with problems, see foci_qa.py (needs numpy).  Set to None to skip
+foci_qa_file = None # e.g. 'foci_qa.tsv'
+# optional MNI brain mask for foci QA and ALE (.npz with 'mask' and 'affine');  None uses the bounding box only
+brain_mask_file = None
+# built-in ALE (see ale.py, needs numpy):  ALE, p and z maps for each factor - all studies, each disorder, and each
+#  pooled contrast file (with the difference map of the two disorders) - saved as .npz in this directory under
+#  the output directory.  Set to None to skip and use GingerALE on the text files instead
+ale_dir = None # e.g. 'ale'
+ale_voxel_size = 4.0 # mm;  GingerALE uses 2 mm
+ale_q = 0.05 # voxel-wise false discovery rate
+# permutation test of each pair of disorders (label shuffling, as GingerALE contrasts), with the built-in ALE;
+#  p-value maps saved as contrast_<factor>_<disorder>_<disorder>.npz in ale_dir.  0 skips.  Runs on `workers` processes,
+#  and can be interrupted and resumed (checkpoints next to the maps)
+contrast_permutations = 0 # e.g. 10000
+permutation_seed = 0
+# disk cache of each experiment's modelled activation map for the built-in ALE (memory-mapped .npy files, keyed by
+#  foci and N), so only new or changed experiments are recomputed across pools and runs;  least recently used maps are
+#  deleted beyond ma_cache_mb.  Relative to the output directory.  Set to None to compute every map every time
+ma_cache_dir = None # e.g. 'ma_cache'
+ma_cache_mb = 1024
+# optionally convert every focus to one space ('MNI' or 'Talairach', Lancaster icbm2tal transform) and also write
+#  single-space copies of each roifile, e.g. rois_resilience_MNI.txt.  Set to None to skip (needs numpy)
+convert_space_to = None
+# disorders to compare in contrast analyses;  every pair gets a pooled file, e.g. rois_resilience_combined_PTSD_SZ.txt
+disorders = ['PTSD','SZ','MDD','BD']
+# any other groups of disorders to pool, e.g. [('PTSD', 'MDD', 'BD')]
+contrast_subsets = []
+# also pool all disorders but one, for each disorder (leave-one-disorder-out)
+contrast_leave_one_out = False
+
+# use ElementTree to easily traverse xml tree
+# if reading from a file....
+#   streaming = False:  ET.parse the whole export, then extract each record
+#   streaming = True:   iterparse one record at a time and clear it once processed, so memory stays flat
+#                       for very large (merged multi-review) exports.  Output files are identical.
+streaming = False
+# cache of extracted studies between runs (see study_cache.py):  only records whose notes, dates, contributors
+#  or titles changed since the last export are re-parsed.  Set to None to always extract every record
+study_cache_file = None # e.g. 'study_cache.pickle'
+# pull the library straight from Zotero instead of reading an exported xml file (see zotero_local_api.py):  the local API
+#  of the Zotero 7 desktop app, 'http://localhost:23119/api/users/0', or the web API with zotero_api_key.  Only items
+#  and notes changed since the last pull are downloaded, over zotero_api_connections concurrent connections;  the
+#  library is kept between runs in zotero_api_state_file (relative to the output directory).  Set to None to read xml_filename
+zotero_api_url = None # e.g. 'http://localhost:23119/api/users/0'
+zotero_api_key = None
+zotero_api_state_file = 'zotero_api_state.pickle'
+zotero_api_connections = 4
+# number of worker processes used to extract records in parallel;  1 extracts serially.  Output is identical either way
+workers = 1
+# timing of each stage (wall and cpu), counters (records, entries, foci, ...) and peak memory, saved as json
+#  (see pipeline_stats.py).  Set to None to skip;  stats_hooks are called as hook(stage, wall, cpu) after each stage
+stats_file = None # e.g. 'pipeline_stats.json'
+stats_hooks = []
+
+# Categories of exclusion criteria for the table of inclusion and exclusion process, with the search terms for each.
+# A reason for exclusion counts towards a category if it contains any of its search terms.
+# (used to be find_exclusion_criteria, scanning every reason for every term once per category;
+#  now all categories are counted in one pass over an index of the reasons, see reason_index.py)
+exclusion_categories = [
+    # sample
+    ('sample', ['sample', 'nonhuman', 'case study']),
+    # no neuroimaging
+    ('no neuroimaging', ['neuroimaging','exclude behavioral only']),
+    # definition of resilience:  i.e. a resilient algorithm or resiliency against traumatic brain injury or postsurgical outcomes
+    ('definition of resilience', ['exclude def']),
+    # exclude because studies cognitive reserve in natural aging - technically a subtype of definition of resilience, but sufficient numbers to warrant its own criteria
+    ('cognitive reserve', ['cognitive reserve']),
+    # exclude because review - note, this also includes 1st pass reviews, so subtract 40 when reporting
+    ('review', ['exclude review']),
+    # exclude because no data: i.e. an abstract from conference proceeding, or a theoretical "white paper"
+    ('no data', ['exclude no data','white paper','no resiliency measure']),
+    # exclude no coordinates provided
+    ('no coordinates', ['exclude no coord','poor source localization']),
+    # behind a paywall that I cannot access - excluding out of respect to Open Science
+    ('paywall', ['paywall']),
+    # atlases other than MNI or TT space, see note in report_exclusion_criteria
+    ('atlas', ['Destrieux','Desikan-Killany','freesurfer']),
+]
 
 
 # sample code to read xml with beautiful soup
@@ -85,515 +167,441 @@ count_exclude_nonMNIorTT_sus = 0
 # example:  N=349ample normativebsp; &amp;nbsp;-21 &amp;nbsp; &amp;nbsp;6 &amp;nbsp; &amp;nbsp;-27
 
 
-# use ElementTree to easily traverse xml tree
-# if reading from a file....
-
-tree = ET.parse(xml_filename)
-root = tree.getroot()
-
-#with open(xml_filename, 'r') as f:
-#    tree = ET.fromstring(f.read())
-#root = tree.getroot()
-
-# and let's create a dictionary of disorders in database
-dict_disorders_res = {}
-dict_disorders_sus = {}
-
-# if reading from string parsed by BeautifulSoup...
-#root = ET.fromstring(bs_content)
-
-## First, generate text files for ROIs promoting resilience:
-with open(roifile_res, 'w', encoding='utf-16') as f:
-    for allrecords in root.findall('records'):
-        for thisrecord in allrecords.findall('record'):
-            # extract relevant information about article
-            # extract year
-            thisdate = thisrecord.findall('dates')
-            thisyear = thisdate[0][0].text
-            #print(thisyear)
-
-            # extract first author surname
-            thiscontributors = thisrecord.findall('contributors')
-            if len(thiscontributors) == 0:
-                thisauthor_full = 'BLANK'
-            else:
-                thisauthor_full = thiscontributors[0][0][0].text
-            thisauthor_split = thisauthor_full.split(',')
-            thisauthor_lastname = thisauthor_split[0]
-            #print(thisauthor_lastname)
-
-            # initialize sample size to 0;   will replace with N=xxx in research-notes  later
-            N=0
-            research_notes = thisrecord.findall('research-notes') # research_notes behaves like a string
-            for temp in research_notes:
-                line = str(temp.text)
-
-                for entry in line.split('\r\r'):
-                    if entry.startswith("n=") or entry.startswith("N="):
-                        entry_split=entry.split('=')
-                        N = entry_split[1]
-
-            # Now, search for "3rd resilienc*" or "4th resilienc*" in "research-notes" field
-            research_notes = thisrecord.findall('research-notes') # redundant, but keeping
-            # let's create dummy flags indicating is coordinates are associated with MDD/depression, PTSD, SZ/schizophrenia
-            MDD = 0
-            PTSD = 0
-            SZ = 0
-            BD = 0
-
-            str_to_write = '' # empty string that will be filled with meta-data and written to file as appropriate
-
-            for temp in research_notes:
-                print_flag = 0
-                # print flag will create block of Sleuth/GingerALE readable text if it finds "4th resilienc*
-                # First line will be commented text with year, author, journal, sample size (?)
-                # Followed by coordinates
-                line = str(temp.text)
-                for entry in line.split('\r\r'):
-                    entry = entry.replace('&nbsp;',' ') # sometimes Zotero web-version replaces spaces with &nbsp;
-                    # identify associated disorder, if any
-                    # first, add to dictionary of disorders
-
-                    if 'diseas' in entry: # extract relevant disorder
-                        #print(entry)
-                        disorder_str = entry.split(' ')
-                        #print(disorder_str)
-                        disorder_str = disorder_str[2]
-                        #print(disorder_str)
-
-                    # next, specifically flag MDD, PTSD, Schizophrenia, BD
-                    if any(word in entry for word in ['MDD','depres']):
-                        MDD = 1
-                    elif 'PTSD' in entry:
-                        PTSD = 1
-                    elif 'schizo' in entry:
-                        SZ = 1
-                    elif 'bipolar' in entry:
-                        BD = 1
-
-                    if entry.startswith("4th res") or entry.startswith("3rd res"): # if entry includes MNI or TT coordinates, then prompts writing of data
-                        #print(thisyear + ' ' + thisauthor_lastname + ' ')
-                        #print(entry) # spot-check:  print output and check for non MNI/TT coordinates
-                        if entry.find(' MNI') > 0:
-                            print_flag = 1
-                            str_to_write = str('\n') + '// Reference=MNI ' + str('\n')
-                        elif entry.find(' TT') > 0:
-                            print_flag = 1
-                            str_to_write = str('\n') + '// Reference=Talairach ' +  str('\n')
-                        else:
-                            # Note: Some articles met inclusion criteria but did not report coordinates in MNI or TT - for example, reported freesurfer regions or reported using Destrieux atlas
-                            # need to separately flag these for exclusion
-                            # Manually count N=7 articles excluded for this reason (resiliency)
-                            print_flag = 0
-                            count_exclude_nonMNIorTT_res += 1
-
-                        if print_flag == 1:  # writing relevant meta-data about study
-                            #str_to_write = str_to_write + entry + str('\n')  # spot-check... confirming resiliency is being written
-                            str_to_write = str_to_write + '// ' + str(thisauthor_lastname) + ' ' + str(thisyear) + str('\n') + '// Subjects=' + str(N) + str('\n')
-                        continue # the next lines in entry are coordinates; so we are leaving print_flag "on" and writing these coordinates.  Code below will "turn off" writing by setting print flag to 0
-                        # this is why I have to serialize, since some studies have both resiliency and susceptibility coordinates
-
-                    elif entry.startswith('4th note'):
-                        print_flag = 0
-                    elif entry.startswith('4th susc') or entry.startswith('3rd susc'):
-                        print_flag = 0
-                    elif entry.startswith("Acces"):
-                        print_flag = 0
-                    elif entry.startswith("N"):
-                        print_flag = 0
-                    elif entry.startswith("n"):
-                        print_flag=0
-                    elif entry.startswith("4th sample") or entry.startswith("3rd sample"):
-                        print_flag = 0
-
-                    if print_flag == 1: # if print_flag is still 1, then there are one or more lines of coordinates to write
-                        entry_split = entry.split()
-                        str_to_write = str_to_write + str(entry_split[1]) + ' ' + str(entry_split[2]) + ' ' +  str(entry_split[3]) + str('\n')
-
-                if len(str_to_write) > 0: # i.e. not empty
-                    #print(thisyear)
-                    #print(thisauthor_lastname)
-                    #print(str_to_write)
-                    f.write(str_to_write)
-
-                    # Also add disorder to disease dictionary
-                    if disorder_str not in dict_disorders_res.keys():
-                        dict_disorders_res[disorder_str] = 0
-                    dict_disorders_res[disorder_str] += 1
-
-                    # and if MDD, PTSD, SZ or BD, write to separate file
-                    if MDD == 1:
-                        str_res_MDD = str_res_MDD + str_to_write
-                    elif PTSD == 1:
-                        str_res_PTSD = str_res_PTSD + str_to_write
-                    elif SZ == 1:
-                        str_res_SZ = str_res_SZ + str_to_write
-                    elif BD == 1:
-                        str_res_BD = str_res_BD + str_to_write
-f.close()
-
-# Now print MDD, PTSD, and SZ specific resilience files
-#   Note: I know there must be a more elegant way.
-#   But this works
-f = open(roifile_res_MDD, 'w', encoding='utf-16')
-f.write(str_res_MDD)
-f.close()
-
-f = open(roifile_res_PTSD, 'w', encoding='utf-16')
-f.write(str_res_PTSD)
-f.close()
-
-f = open(roifile_res_SZ, 'w', encoding='utf-16')
-f.write(str_res_SZ)
-f.close()
-
-f = open(roifile_res_BD, 'w', encoding='utf-16')
-f.write(str_res_BD)
-f.close()
-
-## Repeat for susceptibility
-
-## First, generate text files for ROIs promoting susceptibility:
-with open(roifile_sus, 'w', encoding='utf-16') as f:
-    for allrecords in root.findall('records'):
-        for thisrecord in allrecords.findall('record'):
-            # extract relevant information about article
-            # extract year
-            thisdate = thisrecord.findall('dates')
-            thisyear = thisdate[0][0].text
-            #print(thisyear)
-
-            # extract first author surname
-            thiscontributors = thisrecord.findall('contributors')
-            if len(thiscontributors) == 0:
-                thisauthor_full = 'BLANK'
+def load_library(xml_filename, streaming=False, study_cache_file=None, workers=1, stats=None):
+    # Parse each record only once into a study object (author, year, title, N, disorder flags,
+    # resilience and susceptibility coordinate blocks, inclusion/exclusion reasons).
+    # Returns an iterator of studies (lazy:  records are read as the studies are used) and the study cache, if any;
+    # the cache must be saved once the studies have been used (see run)
+    # stats (a PipelineStats) times parsing and extraction as the studies are read
+    study_cache = None
+    if study_cache_file is not None:
+        from study_cache import StudyCache
+        study_cache = StudyCache(study_cache_file)
+    studies = iter_studies(xml_filename, streaming=streaming, cache=study_cache, workers=workers, stats=stats)
+    if stats is not None:
+        studies = stats.iterate('extract', studies)
+    return studies, study_cache
+
+
+def load_zotero_api(url, state_file=None, connections=4, api_key=None, stats=None):
+    # Like load_library, but pulls the items and their notes from Zotero's local (or web) API, see zotero_local_api.py.
+    # Returns the list of studies, one per item in the order they were added to Zotero.
+    # state_file keeps the library between runs, so only changed items are downloaded and re-extracted
+    from zotero_local_api import pull_library
+    with timed(stats, 'download'):
+        library, pool = pull_library(url, state_file, connections=connections, api_key=api_key)
+    with timed(stats, 'extract'):
+        studies = library.extract_studies()
+    if state_file is not None:
+        with timed(stats, 'cache'):
+            library.save()
+    print('Zotero API: ' + str(len(library.items)) + ' items, ' + str(library.changed) + ' changed since the last pull ('
+          + str(pool.requests) + ' requests on ' + str(pool.connections) + ' connections)')
+    if stats is not None:
+        stats.count('api requests', pool.requests)
+        stats.count('api changes', library.changed)
+        stats.count('cache hits', library.hits)
+        stats.count('cache misses', library.misses)
+    return studies
+
+
+class LibraryResults:
+    # everything write_sleuth collects while going through the studies once
+
+    def __init__(self):
+        # and let's create a dictionary of disorders in database
+        self.dict_disorders_res = {}
+        self.dict_disorders_sus = {}
+
+        # Also use dictionaries to generate list of all reasons for excluding articles
+        # Further note:  each article is either included or excluded, independent of having resilience or susceptibility coordinates
+        self.dict_title = {} # a dictionary for the title of each article, to check for repeats
+        self.dict_empty = {} # a dictionary for articles with empty notes field - these have been missed and need to be checked
+        self.dict_inclusion = {} # dictionary of article titles for all included articles
+        self.dict_exclusion = {} # dictionary of article titles for all excluded articles
+        self.dict_inclusion_exclusion = {} # a dictionary of all inclusion or exclusion criteria for each article
+        self.dict_reason_articles = {} # for each inclusion or exclusion criteria, the articles with it
+        self.malformed_lines = [] # lines inside a block of coordinates that aren't 'label x y z' - skipped, need to be checked
+        self.count_articles = 0 # number of records in the library
+        # counter for included articles that are excluded because coords not in MNI or TT space (e.g. Freesurfer atlases)
+        self.count_exclude_nonMNIorTT_res = 0
+        self.count_exclude_nonMNIorTT_sus = 0
+
+        self.sleuth_outputs = None # the Sleuth/GingerALE writers, with the blocks of each disorder pool for contrasts
+        self.coordinate_table = None # CoordinateTable of all foci, if requested
+        self.study_catalog = None # StudyCatalog of all records, if requested
+        self.duplicate_finder = None # DuplicateFinder with every record, if requested
+        self.contrast_writers = [] # writers of the pooled contrast files
+
+    def add_study(self, study):
+        self.count_articles += 1
+
+        # Also add disorder to disease dictionary
+        for block in study.resilience:
+            if study.disorder not in self.dict_disorders_res.keys():
+                self.dict_disorders_res[study.disorder] = 0
+            self.dict_disorders_res[study.disorder] += 1
+        for block in study.susceptibility:
+            if study.disorder not in self.dict_disorders_sus.keys():
+                self.dict_disorders_sus[study.disorder] = 0
+            self.dict_disorders_sus[study.disorder] += 1
+
+        # Some articles met inclusion criteria but did not report coordinates in MNI or TT (e.g. freesurfer, Destrieux atlas)
+        self.count_exclude_nonMNIorTT_res += study.nonMNIorTT['resilience']
+        self.count_exclude_nonMNIorTT_sus += study.nonMNIorTT['susceptibility']
+
+        for factor, entry in study.malformed:
+            self.malformed_lines.append(study.nameyeartitle + '\t' + factor + '\t' + entry)
+
+        # and record the reasons for inclusion or exclusion of this article
+        nameyeartitle = study.nameyeartitle
+        if nameyeartitle not in self.dict_title.keys():
+            self.dict_title[nameyeartitle] = 0
+        self.dict_title[nameyeartitle] += 1
+
+        if not study.has_notes: # empty article, investigate
+            if nameyeartitle not in self.dict_empty.keys():
+                self.dict_empty[nameyeartitle] = 0
+            self.dict_empty[nameyeartitle] += 1
+
+        for kind, entry in study.criteria:
+            # add article to inclusion or exclusion dictionary
+            if kind == 'include':
+                if nameyeartitle not in self.dict_inclusion.keys():
+                    self.dict_inclusion[nameyeartitle] = 0
+                self.dict_inclusion[nameyeartitle] += 1
             else:
-                thisauthor_full = thiscontributors[0][0][0].text
-            thisauthor_split = thisauthor_full.split(',')
-            thisauthor_lastname = thisauthor_split[0]
-            #print(thisauthor_lastname)
-
-            # initialize sample size to 0;   will replace with N=xxx in research-notes  later
-            N=0
-            research_notes = thisrecord.findall('research-notes') # research_notes behaves like a string
-            for temp in research_notes:
-                line = str(temp.text)
-
-                for entry in line.split('\r\r'):
-                    if entry.startswith("n=") or entry.startswith("N="):
-                        entry_split=entry.split('=')
-                        N = entry_split[1]
-
-            # Now, search for susceptibility in "research-notes" field
-            research_notes = thisrecord.findall('research-notes') # redundant, but keeping
-            # let's create dummy flags indicating is coordinates are associated with MDD/depression, PTSD, SZ/schizophrenia
-            MDD = 0
-            PTSD = 0
-            SZ = 0
-            BD = 0
-
-            str_to_write = '' # empty string that will be filled with meta-data and written to file as appropriate
-
-            for temp in research_notes:
-                print_flag = 0
-                # print flag will create block of Sleuth/GingerALE readable text if it finds "4th susc*
-                # First line will be commented text with year, author, journal, sample size (?)
-                # Followed by coordinates
-                line = str(temp.text)
-                for entry in line.split('\r\r'):
-                    entry = entry.replace('&nbsp;',' ') # sometimes Zotero web-version replaces spaces with &nbsp;
-                    # identify associated disorder, if any
-                    # first, add to dictionary of disorders
-
-                    if 'diseas' in entry: # extract relevant disorder
-                        #print(entry)
-                        disorder_str = entry.split(' ')
-                        #print(disorder_str)
-                        disorder_str = disorder_str[2]
-                        #print(disorder_str)
-
-                    # next, specifically flag MDD, PTSD, Schizophrenia, BD
-                    if any(word in entry for word in ['MDD','depres']):
-                        MDD = 1
-                    elif 'PTSD' in entry:
-                        PTSD = 1
-                    elif 'schizo' in entry:
-                        SZ = 1
-                    elif 'bipolar' in entry:
-                        BD = 1
-
-                    if entry.startswith("4th sus") or entry.startswith("3rd sus"): # if entry includes MNI or TT coordinates, then prompts writing of data
-                        #print(thisyear + ' ' + thisauthor_lastname + ' ')
-                        #print(entry) # spot-check:  print output and check for non MNI/TT coordinates (e.g. Freesurfer)
-                        if entry.find(' MNI') > 0:
-                            print_flag = 1
-                            str_to_write = str('\n') + '// Reference=MNI ' + str('\n')
-                        elif entry.find(' TT') > 0:
-                            print_flag = 1
-                            str_to_write = str('\n') + '// Reference=Talairach ' +  str('\n')
-                        else:
-                            print_flag = 0
-                            # Count 5 articles that meet inclusion criteria but did not report results in MNI or TT (e.g. Freesurfer)
-                            count_exclude_nonMNIorTT_sus += 1
-
-                        if print_flag == 1:  # writing relevant meta-data about study
-                            #str_to_write = str_to_write + entry + str('\n')  # spot-check... confirming susceptibility is being written
-                            str_to_write = str_to_write + '// ' + str(thisauthor_lastname) + ' ' + str(thisyear) + str('\n') + '// Subjects=' + str(N) + str('\n')
-                        continue # the next lines in entry are coordinates; so we are leaving print_flag "on" and writing these coordinates.  Code below will "turn off" writing by setting print flag to 0
-                        # this is why I have to serialize, since some studies have both resiliency and susceptibility coordinates
-
-                    elif entry.startswith('4th note'):
-                        print_flag = 0
-                    elif entry.startswith('4th res') or entry.startswith('3rd res'):
-                        print_flag = 0
-                    elif entry.startswith("Acces"):
-                        print_flag = 0
-                    elif entry.startswith("N"):
-                        print_flag = 0
-                    elif entry.startswith("n"):
-                        print_flag=0
-                    elif entry.startswith("4th sample") or entry.startswith("3rd sample"):
-                        print_flag = 0
-
-                    if print_flag == 1: # if print_flag is still 1, then there are one or more lines of coordinates to write
-                        entry_split = entry.split()
-                        str_to_write = str_to_write + str(entry_split[1]) + ' ' + str(entry_split[2]) + ' ' +  str(entry_split[3]) + str('\n')
-
-                if len(str_to_write) > 0: # i.e. not empty
-                    #print(thisyear)
-                    #print(thisauthor_lastname)
-                    #print(str_to_write)
-                    f.write(str_to_write)
-
-                    # Also add disorder to disease dictionary
-                    if disorder_str not in dict_disorders_sus.keys():
-                        dict_disorders_sus[disorder_str] = 0
-                    dict_disorders_sus[disorder_str] += 1
-
-                    # and if MDD, PTSD, SZ or BD, add to string now, and later write to separate file
-                    if MDD == 1:
-                        str_sus_MDD = str_sus_MDD + str_to_write
-                    elif PTSD == 1:
-                        str_sus_PTSD = str_sus_PTSD + str_to_write
-                    elif SZ == 1:
-                        str_sus_SZ = str_sus_SZ + str_to_write
-                    elif BD == 1:
-                        str_sus_BD = str_sus_BD + str_to_write
-f.close()
-
-# Now print MDD, PTSD, and SZ specific susceptibility files
-#   Note: I know there must be a more elegant way.
-#   But this works
-f = open(roifile_sus_MDD, 'w', encoding='utf-16')
-f.write(str_sus_MDD)
-f.close()
-
-f = open(roifile_sus_PTSD, 'w', encoding='utf-16')
-f.write(str_sus_PTSD)
-f.close()
-
-f = open(roifile_sus_SZ, 'w', encoding='utf-16')
-f.write(str_sus_SZ)
-f.close()
-
-f = open(roifile_sus_BD, 'w', encoding='utf-16')
-f.write(str_sus_BD)
-f.close()
-
-
-# Finally, use dictionaries to generate list of all reasons for excluding articles
-# Note: could integrate this into one (and just one) of code sets above,
-# but best to keep separate, so that the two above clode blocks are symmetric (i.e. only differ in res vs sus)
-# Further note:  each article is either included or excluded, independent of having resilience or susceptibility coordinates
-dict_title = {} # a dictionary for the title of each article, to check for repeats
-dict_empty = {} # a dictionary for articles with empty notes field - these have been missed and need to be checked
-title_list = [] # as above, but a list
-empty_list = [] # as above, but a list
-dict_inclusion = {} # dictionary of article titles for all included articles
-dict_exclusion = {} # dictionary of article titles for all excluded articles
-dict_inclusion_exclusion = {} # a dictionary of all inclusion or exclusion criteria for each article
-
-
-
-
-for allrecords in root.findall('records'):
-    for thisrecord in allrecords.findall('record'):
-        # extract relevant information about article
-        # extract year
-        thisdate = thisrecord.findall('dates')
-        thisyear = thisdate[0][0].text
-        if thisyear is None:
-            thisyear='NoYear'
-        #print(thisyear)
-
-        # extract title
-        thistitle = thisrecord.findall('titles')[0][0].text
-        if thistitle is None:
-            thistitle = 'No title'
-
-        # extract first author surname
-        thiscontributors = thisrecord.findall('contributors')
-        if len(thiscontributors) == 0:
-            thisauthor_full = 'BLANK'
-        else:
-            thisauthor_full = thiscontributors[0][0][0].text
-        thisauthor_split = thisauthor_full.split(',')
-        thisauthor_lastname = thisauthor_split[0]
-        #print(thisauthor_lastname)
-
-        nameyeartitle = thisauthor_lastname + '\t' + thisyear + '\t' + thistitle
-        if nameyeartitle not in dict_title.keys():
-            dict_title[nameyeartitle] = 0
-        dict_title[nameyeartitle] += 1
-
-        research_notes = thisrecord.findall('research-notes') # research_notes behaves like a string
-        if len(research_notes) == 0: # empty article, investigate
-            if nameyeartitle not in dict_empty.keys():
-                dict_empty[nameyeartitle] = 0
-            dict_title[nameyeartitle] += 1
-
-        flag_inclusion = 0 # article was included in final metaanalysis
-        flag_exclusion = 0 # article was excluded from final metaanalysis
-
-        for temp in research_notes:
-            line = str(temp.text)
-            for entry in line.split('\r\r'):
-                entry = entry.replace('&nbsp;',' ') # sometimes Zotero web-version replaces spaces with &nbsp;
-
-                if entry.startswith('4th res') or entry.startswith('3rd res') or entry.startswith('4th sus') or entry.startswith('3rd sus') :
-                    # add article to inclusion dictionary
-                    if nameyeartitle not in dict_inclusion.keys():
-                        dict_inclusion[nameyeartitle] = 0
-                    dict_inclusion[nameyeartitle] += 1
-
-                    # add reason for inclusion to inclusion dictionary
-                    if entry not in dict_inclusion_exclusion.keys():
-                        dict_inclusion_exclusion[entry] = 0
-                    dict_inclusion_exclusion[entry] += 1
-
-                    flag_inclusion = 1
-
-                elif 'exc' in entry:  # else if contains word exclude...
-                    # add article to exclusion dictionary
-                    if 'keep' not in entry:  # adjust for occasional note '1st keep (but maybe exclude later)'
-                        # add article to exclusion dictionary
-                        if nameyeartitle not in dict_exclusion.keys():
-                            dict_exclusion[nameyeartitle] = 0
-                        dict_exclusion[nameyeartitle] += 1
-
-                        if entry not in dict_inclusion_exclusion.keys():
-                            dict_inclusion_exclusion[entry] = 0
-                        dict_inclusion_exclusion[entry] += 1
-
-                        flag_exclusion = 1
-
-        if flag_exclusion == 0 and flag_inclusion == 0:
+                if nameyeartitle not in self.dict_exclusion.keys():
+                    self.dict_exclusion[nameyeartitle] = 0
+                self.dict_exclusion[nameyeartitle] += 1
+
+            # add reason for inclusion or exclusion to dictionary
+            if entry not in self.dict_inclusion_exclusion.keys():
+                self.dict_inclusion_exclusion[entry] = 0
+                self.dict_reason_articles[entry] = []
+            self.dict_inclusion_exclusion[entry] += 1
+            self.dict_reason_articles[entry].append(nameyeartitle)
+
+        if not study.included and not study.excluded:
             print('This article was neither included nor excluded:  ' + nameyeartitle)
 
-## Above code has created dictionary of reasons for inclusion or exclusion
-# Next step:  generate report of reasons for excluding articles
-
-# print all inclusion and exclusion criteria from dictionary, for visualization purposes
-# Also save these to a tsv file for supplemental materials in manuscript
-file_inclusion_exclusion = './dictionary_inclusion_exclusion.tsv'
-with open(file_inclusion_exclusion,'w') as f:
-    print('Reason for Inclusion or Exclusion in Meta-analysis\tNumber of Articles\n')
-    f.write('Reason for Inclusion or Exclusion in Meta-analysis\tNumber of Articles\n')
-    for key, value in dict_inclusion_exclusion.items():
-        print(key + '\t' + str(value))
-        f.write(key + '\t' + str(value) + '\n')
-f.close()
-
-# Disclaimer:  needed guidance from ChatGPT for this solution.
-# creating a definition to make this easier
-def find_exclusion_criteria(this_string, this_dict):
-    exclusion_sum = 0
-    for key, value in this_dict.items():
-        if any(this_string in key for this_string in this_string):
-            exclusion_sum += int(value)
-    print("Total sum of exclusion criteria containing search terms [{}]: {}".format(" or ".join(this_string), exclusion_sum))
-
-# sample
-find_exclusion_criteria(['sample', 'nonhuman', 'case study'], dict_inclusion_exclusion)
-# no neuroimaging
-find_exclusion_criteria(['neuroimaging','exclude behavioral only'], dict_inclusion_exclusion)
-# definition of resilience:  i.e. a resilient algorithm or resiliency against traumatic brain injury or postsurgical outcomes
-find_exclusion_criteria(['exclude def'], dict_inclusion_exclusion)
-# exclude because studies cognitive reserve in natural aging - technically a subtype of definition of resilience, but sufficient numbers to warrant its own criteria
-find_exclusion_criteria(['cognitive reserve'], dict_inclusion_exclusion)
-# exclude because review - note, this also includes 1st pass reviews, so subtract 40 when reporting
-find_exclusion_criteria(['exclude review'], dict_inclusion_exclusion)
-# exclude because no data: i.e. an abstract from conference proceeding, or a theoretical "white paper"
-find_exclusion_criteria(['exclude no data','white paper','no resiliency measure'], dict_inclusion_exclusion)
-# exclude no coordinates provided
-find_exclusion_criteria(['exclude no coord','poor source localization'], dict_inclusion_exclusion)
-# behind a paywall that I cannot access - excluding out of respect to Open Science
-find_exclusion_criteria(['paywall'], dict_inclusion_exclusion)
-
-
-# note, some articles provided ROIs from Desikan-Killany or Destrieux atlases. This is a gray area:
-# technically, these articles meet inclusion for the meta-analyses
-# However, the articles do not provide coordinates.
-# It could be possible to calculate a center of mass for use as coordinates, but that involves speculation beyond scope of original article.
-# For this manuscript, for purposes of creating table of inclusion and exclusion process, we are counting these as exclusions due to "n ocoordinates"
-print('\n')
-print('Total number of articles with exclusion criteria: ' + str(len(dict_exclusion)))
-print('Total number of articles with inclusion criteria: ' + str(len(dict_inclusion)))
-print('Note: the number of articles meeting inclusion criteria includes articles reporting results in atlases other than MNI or TT space (ex: Destrieux atlas).')
-print('To generate table of results, subtract this number from "included articles" and add to "excluded no coordinates"')
-find_exclusion_criteria(['Destrieux','Desikan-Killany','freesurfer'], dict_inclusion_exclusion)
-
-## Conversion issues
-# Text files were written in utf-16 due to a formatting issue.  But Sleuth and GingerALE are having trouble reading.
-# Solution is to read each roifile back in as utf-16 and save as utf-8
-
-for thisfile in [roifile_res,roifile_res_BD,roifile_res_MDD,roifile_res_PTSD,roifile_res_SZ,roifile_sus,roifile_sus_BD,roifile_sus_MDD,roifile_sus_PTSD,roifile_sus_SZ]:
-    with open(thisfile, 'r', encoding='utf-16') as f:
-        TEMP = f.read()
-    f.close()
-
-    with open(thisfile, 'w', encoding='utf-8') as f:
-        f.write(TEMP)
-    f.close()
-
-## Contrast analyses
-# In order to compare activations predicting resilience in one disorder vs. another, have to generate a pooled text file of coordinates
-# Next generate ALE on pooled sample
-# Then gingerALE will compare pooled sample ALE vs. individual sample ALE
-#
-# Logic:  for 4 disorders, iteratively open and combine text file of coordinates
 
-disorders = ['PTSD','SZ','MDD','BD']
-for i in range(len(disorders)):
-    dis1 = disorders[i]
-    for j in range(i+1,len(disorders)):
-        dis2 = disorders[j]
-        file1 = eval('roifile_res_' +dis1)
-        file2 = eval('roifile_res_' + dis2)
-        fileout = './rois_resilience_combined_' + dis1 + '_' + dis2 + '.txt'
-        with open(file1, 'r', encoding='utf-8') as f1:
-            coords1 = f1.read()
-        with open(file2, 'r', encoding='utf-8') as f2:
-            coords2 = f2.read()
-        # note: confirmed that each file ends in a line break, so can just concatenate
-        coords3 = coords1 + coords2
-        with open(fileout, 'w', encoding='utf-8') as f3:
-            f3.write(coords3)
-
-
-# and repeat for susceptibility
-for i in range(len(disorders)):
-    dis1 = disorders[i]
-    for j in range(i+1,len(disorders)):
-        dis2 = disorders[j]
-        file1 = eval('roifile_sus_' +dis1)
-        file2 = eval('roifile_sus_' + dis2)
-        fileout = './rois_susceptibility_combined_' + dis1 + '_' + dis2 + '.txt'
-        with open(file1, 'r', encoding='utf-8') as f1:
-            coords1 = f1.read()
-        with open(file2, 'r', encoding='utf-8') as f2:
-            coords2 = f2.read()
-        # note: confirmed that each file ends in a line break, so can just concatenate
-        coords3 = coords1 + coords2
-        with open(fileout, 'w', encoding='utf-8') as f3:
-            f3.write(coords3)
+def output_path(dir_output, filename):
+    return os.path.join(dir_output, filename)
+
+
+def write_sleuth(studies, dir_output, roifiles, coordinate_table=False, study_catalog=False, duplicates=False, keep_pools=True, stats=None):
+    # First, generate text files for ROIs promoting resilience and susceptibility:
+    # Each Sleuth/GingerALE text file is kept open and written directly as utf-8 (see report_conversion_issues).
+    # Every study's coordinate blocks go straight into the total file and, if MDD, PTSD, SZ or BD, the separate disorder file.
+    # All other outputs are collected from the same single loop over the studies.
+    #   coordinate_table=True also collects every focus into a CoordinateTable (needs numpy)
+    #   study_catalog=True also collects a StudyCatalog of every record (needs numpy;  its foci are the coordinate table)
+    #   duplicates=True also collects titles and foci for report_duplicates (needs numpy)
+    #   keep_pools=True keeps the blocks of each disorder pool for write_contrasts
+    #   stats (a PipelineStats) counts records, entries, blocks and foci;  time spent here, outside of reading
+    #   the studies, is the 'write sleuth' stage
+    results = LibraryResults()
+
+    coordinate_builder = None
+    catalog_builder = None
+    if study_catalog:
+        from study_catalog import StudyCatalogBuilder
+        catalog_builder = StudyCatalogBuilder()
+    elif coordinate_table:
+        from coordinate_store import CoordinateTableBuilder
+        coordinate_builder = CoordinateTableBuilder()
+    if duplicates:
+        from duplicate_records import DuplicateFinder
+        results.duplicate_finder = DuplicateFinder()
+
+    paths = {factor: {pool: output_path(dir_output, roifile) for pool, roifile in files.items()} for factor, files in roifiles.items()}
+    with timed(stats, 'write sleuth'), SleuthOutputs(paths, keep_pools=keep_pools) as sleuth_outputs:
+        for study in studies:
+            sleuth_outputs.write_study(study)
+            if coordinate_builder is not None:
+                coordinate_builder.add_study(study)
+            if catalog_builder is not None:
+                catalog_builder.add_study(study)
+            if results.duplicate_finder is not None:
+                results.duplicate_finder.add_study(study)
+            results.add_study(study)
+            if stats is not None:
+                count_study(stats, study)
+
+    results.sleuth_outputs = sleuth_outputs
+    if coordinate_builder is not None:
+        with timed(stats, 'coordinate store'):
+            results.coordinate_table = coordinate_builder.build()
+    if catalog_builder is not None:
+        with timed(stats, 'study catalog'):
+            results.study_catalog = catalog_builder.build()
+            results.coordinate_table = results.study_catalog.foci
+    return results
+
+
+def count_study(stats, study):
+    stats.count('records')
+    stats.count('entries', study.entries)
+    for factor in ('resilience', 'susceptibility'):
+        blocks = getattr(study, factor)
+        stats.count(factor + ' blocks', len(blocks))
+        stats.count(factor + ' foci', sum(len(block.coordinates) for block in blocks))
+    stats.count('included', study.included)
+    stats.count('excluded', study.excluded)
+    stats.count('malformed lines', len(study.malformed))
+
+
+def write_converted_space(results, target, dir_output, roifiles):
+    # Mixed-space pools:  convert all Talairach foci to MNI (or the reverse) at once and write single-space files
+    from coordinate_transform import convert_space
+    from sleuth_output import SleuthWriter, format_table_blocks
+    coordinate_table_converted = convert_space(results.coordinate_table, target)
+    for factor, files in roifiles.items():
+        for pool, roifile in files.items():
+            # pool '' is the total file for this factor
+            pooled = coordinate_table_converted.select(factor=factor, disorder=pool if pool != '' else None)
+            with SleuthWriter(output_path(dir_output, roifile.replace('.txt', '_' + target + '.txt'))) as f:
+                for str_to_write in format_table_blocks(pooled):
+                    f.write(str_to_write)
+            # e.g. nan for coordinates that weren't numbers in the notes
+            for problem in f.problems:
+                print('Warning: GingerALE will not be able to read this line in ' + f.filename + ':  ' + problem)
+
+
+def write_inclusion_exclusion(results, filename):
+    # print all inclusion and exclusion criteria from dictionary, for visualization purposes
+    # Also save these to a tsv file for supplemental materials in manuscript
+    with open(filename,'w') as f:
+        print('Reason for Inclusion or Exclusion in Meta-analysis\tNumber of Articles\n')
+        f.write('Reason for Inclusion or Exclusion in Meta-analysis\tNumber of Articles\n')
+        for key, value in results.dict_inclusion_exclusion.items():
+            print(key + '\t' + str(value))
+            f.write(key + '\t' + str(value) + '\n')
+
+
+def print_exclusion_criteria(row):
+    print("Total sum of exclusion criteria containing search terms [{}]: {}".format(" or ".join(row['terms']), row['total']))
+
+
+def report_exclusion_criteria(results, categories=None):
+    # returns one row per category: category, terms, total, reasons, articles
+    if categories is None:
+        categories = exclusion_categories
+    reason_index = ReasonIndex(results.dict_inclusion_exclusion, results.dict_reason_articles)
+    exclusion_table = reason_index.query(categories)
+
+    for row in exclusion_table:
+        if row['category'] != 'atlas':
+            print_exclusion_criteria(row)
+
+    # note, some articles provided ROIs from Desikan-Killany or Destrieux atlases. This is a gray area:
+    # technically, these articles meet inclusion for the meta-analyses
+    # However, the articles do not provide coordinates.
+    # It could be possible to calculate a center of mass for use as coordinates, but that involves speculation beyond scope of original article.
+    # For this manuscript, for purposes of creating table of inclusion and exclusion process, we are counting these as exclusions due to "n ocoordinates"
+    print('\n')
+    print('Total number of articles with exclusion criteria: ' + str(len(results.dict_exclusion)))
+    print('Total number of articles with inclusion criteria: ' + str(len(results.dict_inclusion)))
+    print('Note: the number of articles meeting inclusion criteria includes articles reporting results in atlases other than MNI or TT space (ex: Destrieux atlas).')
+    print('To generate table of results, subtract this number from "included articles" and add to "excluded no coordinates"')
+    for row in exclusion_table:
+        if row['category'] == 'atlas':
+            print_exclusion_criteria(row)
+    return exclusion_table
+
+
+def report_conversion_issues(results):
+    ## Conversion issues
+    # Text files were written in utf-16 due to a formatting issue.  But Sleuth and GingerALE were having trouble reading.
+    # Old solution was to read each roifile back in as utf-16 and save as utf-8.
+    # Now every roifile is written once, directly as utf-8, and checked while writing - just report anything GingerALE can't read
+    for writer in results.sleuth_outputs:
+        for problem in writer.problems:
+            print('Warning: GingerALE will not be able to read this line in ' + writer.filename + ':  ' + problem)
+    for line in results.malformed_lines:
+        print('Warning: skipped coordinate line that is not "label x y z":  ' + line)
+
+
+def report_duplicates(results, filename):
+    # dict_title only catches exact repeats of author, year and title;  also look for the same article under a slightly
+    # different title (merged first pass and grey literature searches) and for identical sets of foci
+    duplicate_groups = results.duplicate_finder.find()
+    results.duplicate_finder.write(duplicate_groups, filename)
+    if len(duplicate_groups) > 0:
+        print('Warning: ' + str(len(duplicate_groups)) + ' groups of possible duplicate records, see ' + filename)
+    return duplicate_groups
+
+
+def report_foci_qa(results, filename, brain_mask_file=None):
+    # Coordinates are copied from the notes as typed - check them all at once before they go into GingerALE
+    from foci_qa import check_foci, load_brain_mask, study_report, write_report
+    brain_mask = load_brain_mask(brain_mask_file) if brain_mask_file is not None else None
+    checks = check_foci(results.coordinate_table, brain_mask)
+    report = study_report(results.coordinate_table, checks)
+    n_problems = write_report(report, filename)
+    if n_problems > 0:
+        print('Warning: ' + str(n_problems) + ' studies with questionable foci (' + ', '.join(
+            str(int(flags.sum())) + ' ' + name for name, flags in checks.items()) + '), see ' + filename)
+    return report
+
+
+def run_ale(results, dir_ale, disorders, subsets=(), leave_one_out=False, voxel_size=4.0, q=0.05, brain_mask_file=None,
+            permutations=0, seed=0, workers=1, ma_cache_dir=None, ma_cache_mb=1024):
+    # ALE for the same pools as the Sleuth/GingerALE files:  all studies, each disorder, and each contrast pool.
+    # With permutations > 0, each pair of disorders is also tested by shuffling experiments between the two
+    # With ma_cache_dir, every experiment's MA map is computed once and re-used by every pool (and by later runs)
+    from ale import ALEGrid, ale, experiment_foci, save_ale
+    if brain_mask_file is not None:
+        from foci_qa import load_brain_mask
+        grid = ALEGrid.from_brain_mask(load_brain_mask(brain_mask_file), voxel_size)
+    else:
+        grid = ALEGrid(voxel_size)
+    os.makedirs(dir_ale, exist_ok=True)
+    ma_maps = None
+    if ma_cache_dir is not None:
+        from ma_cache import MACache
+        ma_maps = MACache(ma_cache_dir, grid, max_bytes=ma_cache_mb * 2 ** 20)
+    table = results.coordinate_table
+    ale_results = {}
+    pool_experiments = {}
+    for factor in results.sleuth_outputs.writers:
+        pools = [()] + [(disorder,) for disorder in results.sleuth_outputs.pools(factor)]
+        pools += contrast_pools(disorders, subsets, leave_one_out=leave_one_out, known=results.sleuth_outputs.pools(factor))
+        for pool in pools:
+            experiments = experiment_foci(table, grid, table.mask(factor=factor, disorder=list(pool) if pool else None))
+            pool_experiments[(factor, pool)] = experiments
+            result = ale(experiments, grid, q=q, ma_maps=ma_maps)
+            if len(pool) == 2 and (factor, pool[:1]) in ale_results and (factor, pool[1:]) in ale_results:
+                # contrast:  difference of the two disorders' ALE maps (significance by permutation, see contrast_permutation.py)
+                result['difference'] = ale_results[(factor, pool[:1])]['ale'] - ale_results[(factor, pool[1:])]['ale']
+            ale_results[(factor, pool)] = result
+            name = 'ale_' + factor + ('_combined_' if len(pool) > 1 else '_') + '_'.join(pool) if pool else 'ale_' + factor
+            save_ale(result, grid, os.path.join(dir_ale, name + '.npz'))
+            print('ALE ' + name + ':  ' + str(result['experiments']) + ' experiments, ' + str(result['foci']) + ' foci, '
+                  + str(int(result['significant'].sum())) + ' significant voxels'
+                  + (' (p <= ' + '%.2g' % result['threshold'] + ')' if result['significant'].any() else ''))
+
+            if permutations > 0 and 'difference' in result:
+                from contrast_permutation import contrast_test, save_contrast
+                name = 'contrast_' + factor + '_' + '_'.join(pool)
+                checkpoint = os.path.join(dir_ale, name + '.checkpoint.npz')
+                contrast = contrast_test(pool_experiments[(factor, pool[:1])], pool_experiments[(factor, pool[1:])], grid,
+                                         n_permutations=permutations, seed=seed, workers=workers, checkpoint=checkpoint,
+                                         ma_maps=ma_maps)
+                save_contrast(contrast, grid, os.path.join(dir_ale, name + '.npz'))
+                if os.path.exists(checkpoint):  # not written if there was nothing to permute
+                    os.remove(checkpoint)
+                result['contrast'] = contrast
+                print('Contrast ' + name + ' (' + str(permutations) + ' permutations):  '
+                      + str(int((contrast['p_greater'] < 0.01).sum())) + ' voxels ' + pool[0] + ' > ' + pool[1] + ', '
+                      + str(int((contrast['p_less'] < 0.01).sum())) + ' voxels ' + pool[1] + ' > ' + pool[0] + ' (p < 0.01)')
+    if ma_maps is not None:
+        print('MA map cache:  ' + str(ma_maps.hits) + ' re-used, ' + str(ma_maps.misses) + ' computed, '
+              + '%.1f' % (ma_maps.size() / 2 ** 20) + ' MB')
+    return ale_results
+
+
+def write_contrasts(results, dir_output, disorders, subsets=(), leave_one_out=False):
+    ## Contrast analyses
+    # In order to compare activations predicting resilience in one disorder vs. another, have to generate a pooled text file of coordinates
+    # Next generate ALE on pooled sample
+    # Then gingerALE will compare pooled sample ALE vs. individual sample ALE
+    #
+    # Logic:  for every pair of disorders (and any subsets), write the blocks of each disorder in turn into one pooled file.
+    # The blocks were kept in memory while writing the per-disorder files, so nothing is read back in
+    for factor in results.sleuth_outputs.writers:
+        for pool in contrast_pools(disorders, subsets, leave_one_out=leave_one_out, known=results.sleuth_outputs.pools(factor)):
+            fileout = output_path(dir_output, 'rois_' + factor + '_combined_' + '_'.join(pool) + '.txt')
+            results.contrast_writers.append(results.sleuth_outputs.write_pooled(factor, pool, fileout))
+    return results.contrast_writers
+
+
+def write_summary(results, xml_filename, exclusion_table, filename):
+    # Summary of this run, in machine-readable form (merged across libraries by batch_zotero_libraries.py)
+    summary = {
+        'xml_filename': xml_filename,
+        'articles': results.count_articles,
+        'included': len(results.dict_inclusion),
+        'excluded': len(results.dict_exclusion),
+        'nonMNIorTT': {'resilience': results.count_exclude_nonMNIorTT_res, 'susceptibility': results.count_exclude_nonMNIorTT_sus},
+        'exclusion_categories': {row['category']: row['total'] for row in exclusion_table},
+        'roifiles': {os.path.basename(writer.filename): {'experiments': writer.experiments, 'foci': writer.foci}
+                     for writer in list(results.sleuth_outputs) + results.contrast_writers},
+    }
+    with open(filename, 'w') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def run(xml_filename=xml_filename, dir_output=dir_workspace, stats=None):
+    # The whole pipeline, with the settings at the top of this file
+    # (stats:  a PipelineStats to fill in;  by default one is made, and saved, if stats_file or stats_hooks is set)
+    if stats is None and (stats_file is not None or len(stats_hooks) > 0):
+        stats = PipelineStats(hooks=stats_hooks)
+    if zotero_api_url is not None:
+        studies, study_cache = load_zotero_api(zotero_api_url, connections=zotero_api_connections, api_key=zotero_api_key, stats=stats,
+                                               state_file=output_path(dir_output, zotero_api_state_file) if zotero_api_state_file is not None else None), None
+    else:
+        studies, study_cache = load_library(xml_filename, streaming=streaming, workers=workers, stats=stats,
+                                            study_cache_file=output_path(dir_output, study_cache_file) if study_cache_file is not None else None)
+    results = write_sleuth(studies, dir_output, roifiles, coordinate_table=(coordinate_store_file is not None or convert_space_to is not None or foci_qa_file is not None
+                                             or ale_dir is not None),
+                           study_catalog=study_catalog_file is not None, duplicates=duplicates_file is not None, stats=stats)
+    # Check the contrast settings now, so a disorder with no file stops the run before any report is written
+    for factor in results.sleuth_outputs.writers:
+        contrast_pools(disorders, contrast_subsets, leave_one_out=contrast_leave_one_out, known=results.sleuth_outputs.pools(factor))
+
+    if study_cache is not None:
+        with timed(stats, 'cache'):
+            study_cache.save()
+        if stats is not None:
+            stats.count('cache hits', study_cache.hits)
+            stats.count('cache misses', study_cache.misses)
+    if coordinate_store_file is not None:
+        with timed(stats, 'coordinate store'):
+            results.coordinate_table.save(output_path(dir_output, coordinate_store_file))
+    if study_catalog_file is not None:
+        with timed(stats, 'study catalog'):
+            results.study_catalog.save(output_path(dir_output, study_catalog_file))
+    if convert_space_to is not None:
+        with timed(stats, 'space conversion'):
+            write_converted_space(results, convert_space_to, dir_output, roifiles)
+
+    ## Above code has created dictionary of reasons for inclusion or exclusion
+    # Next step:  generate report of reasons for excluding articles
+    with timed(stats, 'inclusion/exclusion'):
+        write_inclusion_exclusion(results, output_path(dir_output, file_inclusion_exclusion))
+        exclusion_table = report_exclusion_criteria(results)
+    with timed(stats, 'conversion issues'):
+        report_conversion_issues(results)
+    if foci_qa_file is not None:
+        with timed(stats, 'foci qa'):
+            report_foci_qa(results, output_path(dir_output, foci_qa_file), brain_mask_file)
+    if duplicates_file is not None:
+        with timed(stats, 'duplicates'):
+            report_duplicates(results, output_path(dir_output, duplicates_file))
+    with timed(stats, 'contrasts'):
+        write_contrasts(results, dir_output, disorders, contrast_subsets, leave_one_out=contrast_leave_one_out)
+    if ale_dir is not None:
+        with timed(stats, 'ale'):
+            run_ale(results, output_path(dir_output, ale_dir), disorders, contrast_subsets, leave_one_out=contrast_leave_one_out,
+                    voxel_size=ale_voxel_size, q=ale_q, brain_mask_file=brain_mask_file,
+                    permutations=contrast_permutations, seed=permutation_seed, workers=workers,
+                    ma_cache_dir=output_path(dir_output, ma_cache_dir) if ma_cache_dir is not None else None, ma_cache_mb=ma_cache_mb)
+    with timed(stats, 'summary'):
+        write_summary(results, zotero_api_url if zotero_api_url is not None else xml_filename, exclusion_table, output_path(dir_output, file_summary))
+    if stats is not None and stats_file is not None:
+        stats.save(output_path(dir_output, stats_file))
+    return results
+
+
+def main(argv):
+    # Optionally, XML file and workspace directory can be given on the command line (used by batch_zotero_libraries.py):
+    #   python import_zotero_xml_output_all.py [xml_filename [dir_workspace]]
+    run(argv[0] if len(argv) > 0 else xml_filename,
+        argv[1] if len(argv) > 1 else dir_workspace)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,82 @@
+# Purpose:
+# Disk cache of modelled activation (MA) maps, so re-running ALE on different subsets (all studies, each disorder,
+# pooled pairs, leave-one-out, permutations) only computes the kernels of experiments that are new or changed.
+#
+# Each MA map is a float32 .npy file, opened memory-mapped, so analyses read cached maps straight from disk.
+# Files are keyed by a hash of the experiment's foci (voxel indices on the MNI grid, after any space conversion),
+# sample size N and the grid, so a changed focus or N gives a new entry.
+# The cache is bounded in size:  when it grows past max_bytes the least recently used maps are deleted.
+#
+# Note, needs numpy
+
+import hashlib
+import os
+import time
+
+import numpy as np
+
+from ale import ma_map
+from atomic_file import atomic_write
+
+
+class MACache:
+
+    def __init__(self, directory, grid, max_bytes=2 ** 30):
+        self.directory = directory
+        self.grid = grid
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        # key -> [bytes, last used];  last use starts as the file's modification time, which is updated on each hit
+        self.entries = {}
+        for name in os.listdir(directory):
+            if name.endswith('.npy') and not name.endswith('.tmp.npy'):  # not left over from an interrupted write
+                stat = os.stat(os.path.join(directory, name))
+                self.entries[name[:-len('.npy')]] = [stat.st_size, stat.st_mtime]
+        self.evict()
+
+    def key(self, ijk, N):
+        digest = hashlib.sha1()
+        digest.update(repr(('MNI', int(N), self.grid.voxel_size, self.grid.shape)).encode())
+        digest.update(np.ascontiguousarray(ijk, dtype=np.int64).tobytes())
+        return digest.hexdigest()
+
+    def filename(self, key):
+        return os.path.join(self.directory, key + '.npy')
+
+    def touch(self, key):
+        # last use is also kept as the file's modification time, so the order survives restarts
+        self.entries[key][1] = time.time()
+        os.utime(self.filename(key))
+
+    def __call__(self, experiment, ijk, N):
+        # same signature as the ma_maps argument of ale.ale and contrast_permutation.contrast_test
+        key = self.key(ijk, N)
+        if key in self.entries and os.path.exists(self.filename(key)):
+            self.hits += 1
+            self.touch(key)
+            return np.load(self.filename(key), mmap_mode='r')
+        self.misses += 1
+        ma = ma_map(ijk, N, self.grid).astype(np.float32)
+        atomic_write(self.filename(key), lambda temp_filename: np.save(temp_filename, ma))
+        self.entries[key] = [os.path.getsize(self.filename(key)), time.time()]
+        self.evict(keep=key)
+        return ma
+
+    def evict(self, keep=None):
+        # delete least recently used maps until the cache fits in max_bytes (the map just stored is kept)
+        total = sum(size for size, _ in self.entries.values())
+        for key in sorted(self.entries, key=lambda key: self.entries[key][1]):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= self.entries.pop(key)[0]
+            try:
+                os.remove(self.filename(key))
+            except OSError:
+                pass  # already gone, or still memory-mapped on Windows - it'll go next time
+
+    def size(self):
+        return sum(size for size, _ in self.entries.values())
@@ -0,0 +1,140 @@
+# Purpose:
+# Timing and counters for each stage of the pipeline (parse, extract, write sleuth, inclusion/exclusion,
+# space conversion, conversion issues, contrasts, ...), so we can see which stage dominates on large exports
+# and track regressions.
+#
+# Wall and CPU time are exclusive per stage:  while a nested stage runs (e.g. parsing the next record while
+# extracting studies), its time is only counted towards the nested stage.
+# Results can be saved as json (see as_dict / save), and hooks are called as each stage finishes:
+#   stats = PipelineStats(hooks=[lambda name, wall, cpu: print(name, wall, cpu)])
+#
+# Extraction is a single pass over the records, so resilience and susceptibility don't have stages of their own;
+# their blocks and foci are counted instead.
+
+import json
+import sys
+import time
+from contextlib import nullcontext
+
+try:
+    import resource  # not available on Windows
+except ImportError:
+    resource = None
+
+
+def peak_memory_mb(who='self'):
+    # peak resident memory of this process ('self') or of the largest finished worker process ('children'),
+    # None where the platform can't tell us
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF if who == 'self' else resource.RUSAGE_CHILDREN).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    if sys.platform == 'darwin':
+        return round(maxrss / 2 ** 20, 1)
+    return round(maxrss / 2 ** 10, 1)
+
+
+class PipelineStats:
+
+    def __init__(self, hooks=()):
+        self.hooks = list(hooks)  # called as hook(stage name, wall seconds, cpu seconds) when a stage finishes
+        self.stages = {}  # stage name -> {'wall', 'cpu', 'calls'}
+        self.counters = {}
+        self.active = []  # stack of running stages: [name, wall start, cpu start]
+        self.start = time.perf_counter()
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def _pause(self):
+        # add the time since the running stage (re)started to its totals
+        name, wall, cpu = self.active[-1]
+        stage = self.stages.setdefault(name, {'wall': 0.0, 'cpu': 0.0, 'calls': 0})
+        now_wall, now_cpu = time.perf_counter(), time.process_time()
+        stage['wall'] += now_wall - wall
+        stage['cpu'] += now_cpu - cpu
+        return now_wall, now_cpu
+
+    def _enter(self, name):
+        if self.active:
+            self._pause()
+        self.active.append([name, time.perf_counter(), time.process_time()])
+
+    def _exit(self):
+        now_wall, now_cpu = self._pause()
+        self.active.pop()
+        if self.active:
+            self.active[-1][1:] = [now_wall, now_cpu]
+
+    def _finish(self, name, wall, cpu):
+        self.stages[name]['calls'] += 1
+        for hook in self.hooks:
+            hook(name, self.stages[name]['wall'] - wall, self.stages[name]['cpu'] - cpu)
+
+    def _totals(self, name):
+        stage = self.stages.get(name)
+        return (stage['wall'], stage['cpu']) if stage is not None else (0.0, 0.0)
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def iterate(self, name, iterable):
+        # time spent producing each item of iterable counts towards stage name;  hooks are called once, at the end
+        iterator = iter(iterable)
+        wall, cpu = self._totals(name)
+        while True:
+            self._enter(name)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self._exit()
+                self._finish(name, wall, cpu)
+                return
+            except BaseException:
+                self._exit()
+                raise
+            self._exit()
+            yield item
+
+    def as_dict(self):
+        wall = time.perf_counter() - self.start
+        records = self.counters.get('records', 0)
+        # throughput of the record-by-record stages (parse + extract)
+        extract_wall = sum(self.stages.get(name, {}).get('wall', 0.0) for name in ('parse', 'extract'))
+        return {
+            'wall': round(wall, 6),
+            'records_per_s': round(records / extract_wall, 1) if extract_wall > 0 else None,
+            'peak_memory_mb': peak_memory_mb('self'),
+            'peak_memory_workers_mb': peak_memory_mb('children'),
+            'stages': {name: {'wall': round(stage['wall'], 6), 'cpu': round(stage['cpu'], 6), 'calls': stage['calls']}
+                       for name, stage in self.stages.items()},
+            'counters': dict(self.counters),
+        }
+
+    def save(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.as_dict(), f, indent=2)
+
+
+class _Stage:
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.totals = self.stats._totals(self.name)
+        self.stats._enter(self.name)
+        return self
+
+    def __exit__(self, *exc):
+        self.stats._exit()
+        self.stats._finish(self.name, *self.totals)
+
+
+def timed(stats, name):
+    # stats.stage(name), or nothing when stats is None (instrumentation off)
+    return stats.stage(name) if stats is not None else nullcontext()
@@ -0,0 +1,48 @@
+# Purpose:
+# Index of the reasons for inclusion or exclusion (dict_inclusion_exclusion), built once, so the category counts
+# for the table of inclusion and exclusion (PRISMA) can be recomputed cheaply.
+#
+# find_exclusion_criteria used to scan every reason for every search term, once per category.
+# Here each search term is looked up once (a C-level substring check over the reasons), and the set of reasons
+# containing it is kept, so categories sharing terms, and later queries, only take unions of those sets.
+
+
+class ReasonIndex:
+    #   reason_counts:   reason -> number of articles (dict_inclusion_exclusion)
+    #   reason_articles: reason -> list of articles (author, year, title) with that reason, optional
+
+    def __init__(self, reason_counts, reason_articles=None):
+        self.reason_counts = reason_counts
+        self.reason_articles = reason_articles if reason_articles is not None else {}
+        self.order = {reason: i for i, reason in enumerate(reason_counts)}  # dictionary order, for the output
+        self.term_reasons = {}  # search term -> set of reasons containing it, filled in as terms are queried
+
+    def reasons_with(self, term):
+        if term not in self.term_reasons:
+            self.term_reasons[term] = {reason for reason in self.reason_counts if term in reason}
+        return self.term_reasons[term]
+
+    def query(self, categories):
+        # categories: list of (name, search terms).  A reason counts towards a category if it contains any of its terms.
+        # Returns one row per category:  name, terms, total (sum over matching reasons, as find_exclusion_criteria),
+        # reasons, and articles (each listed once)
+        table = []
+        for name, terms in categories:
+            matched = set()
+            for term in terms:
+                matched |= self.reasons_with(term)
+            reasons = sorted(matched, key=self.order.__getitem__)  # keep dictionary order
+            articles = {}
+            for reason in reasons:
+                articles.update(dict.fromkeys(self.reason_articles.get(reason, [])))
+            table.append({
+                'category': name,
+                'terms': list(terms),
+                'total': sum(int(self.reason_counts[reason]) for reason in reasons),
+                'reasons': reasons,
+                'articles': list(articles),
+            })
+        return table
+
+    def find(self, terms):
+        return self.query([(' or '.join(terms), terms)])[0]
@@ -0,0 +1,181 @@
+# Purpose:
+# Write Sleuth/GingerALE compliant text files from extracted studies.
+#
+# Files used to be written in utf-16, read back in full and rewritten as utf-8 (GingerALE could not read utf-16).
+# Now each file is written once, directly in its final utf-8 form, and every block is checked once, when it is
+# formatted, so we know GingerALE can read the result without opening the file again.
+
+import itertools
+import re
+from dataclasses import dataclass
+from typing import Tuple
+
+
+def format_sleuth_block(study, block):
+    # First line is commented text with reference space, then author and year, then sample size
+    # Followed by coordinates
+    header = '\n// Reference=' + block.reference + ' \n' + '// ' + str(study.author) + ' ' + str(study.year) + '\n' + '// Subjects=' + str(study.N) + '\n'
+    return header + ''.join(x + ' ' + y + ' ' + z + '\n' for x, y, z in block.coordinates)
+
+
+def format_table_blocks(table):
+    # Sleuth/GingerALE blocks from a CoordinateTable (e.g. after converting every focus to one space).
+    # Rows of each experiment are contiguous in the table;  coordinates are written with two decimals
+    from coordinate_store import SPACES
+    experiment = table.experiment.tolist()
+    space = table.space.tolist()
+    xyz = table.xyz.tolist()
+    i = 0
+    while i < len(experiment):
+        j = i
+        while j < len(experiment) and experiment[j] == experiment[i]:
+            j += 1
+        header = '\n// Reference=' + SPACES[space[i]] + ' \n' + '// ' + str(table.experiment_label[experiment[i]]) + '\n' + '// Subjects=' + str(table.experiment_N[experiment[i]]) + '\n'
+        yield header + ''.join('%.2f %.2f %.2f\n' % (x, y, z) for x, y, z in xyz[i:j])
+        i = j
+
+
+# a coordinate GingerALE can read:  a finite decimal number (float() would also take nan, inf and 1_000)
+NUMBER = r'[+-]?(?:[0-9]+(?:\.[0-9]*)?|\.[0-9]+)(?:[eE][+-]?[0-9]+)?'
+FOCUS_LINE = re.compile(r'[^\S\n]*' + NUMBER + r'[^\S\n]+' + NUMBER + r'[^\S\n]+' + NUMBER + r'[^\S\n]*')
+# a whole block (or file) of blank lines, // comments and foci, checked in one match
+SLEUTH_TEXT = re.compile(r'(?:(?://[^\n]*|' + FOCUS_LINE.pattern + r')?\n)*(?://[^\n]*|' + FOCUS_LINE.pattern + r')?')
+
+
+def is_focus(line):
+    return FOCUS_LINE.fullmatch(line) is not None
+
+
+def check_sleuth_text(text):
+    # GingerALE reads blank lines between experiments, '//' comment lines, and one focus per line as three numbers.
+    # Returns a list of lines it would choke on.
+    if SLEUTH_TEXT.fullmatch(text):
+        return []
+    return [line for line in text.split('\n') if line != '' and not line.startswith('//') and not is_focus(line)]
+
+
+@dataclass(frozen=True)
+class SleuthBlock:
+    # a formatted block, checked and counted once, so it can go into several files (total, disorder, contrast pools)
+    text: str
+    experiments: int  # number of // Reference=... lines
+    foci: int  # number of coordinate lines
+    problems: Tuple[str, ...]  # lines GingerALE will not be able to read
+
+
+def sleuth_block(text):
+    # Line endings match what the old utf-16 -> utf-8 round trip produced (universal newlines)
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+    lines = text.split('\n')
+    foci = len(lines) - lines.count('') - text.count('\n//') - text.startswith('//')
+    return SleuthBlock(text, text.count('// Reference='), foci, tuple(check_sleuth_text(text)))
+
+
+class SleuthWriter:
+    # utf-8 Sleuth/GingerALE text file, written in one buffered pass.
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.problems = []  # lines GingerALE will not be able to read
+        self.experiments = 0  # number of blocks (// Reference=...) written
+        self.foci = 0  # number of coordinate lines written
+        self.f = open(filename, 'w', encoding='utf-8')
+
+    def write(self, text):
+        self.write_block(sleuth_block(text))
+
+    def write_block(self, block):
+        # a SleuthBlock, already checked and counted
+        self.problems += block.problems
+        self.experiments += block.experiments
+        self.foci += block.foci
+        self.f.write(block.text)
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SleuthOutputs:
+    # One open SleuthWriter per output: the total file and each per-disorder file, for each factor.
+    # Each study's blocks are streamed into the right files as soon as the study is extracted,
+    # so memory is bounded by a single study instead of the whole pooled output.
+    #   roifiles = {'resilience': {'': 'rois_resilience.txt', 'MDD': 'rois_resilience_MDD.txt', ...}, ...}
+    #   key '' is the total file for that factor; other keys are disorder pools (block.pool)
+    # With keep_pools=True, the blocks of each disorder pool are also kept (as a list, not concatenated)
+    # so pooled contrast files can be written from memory afterwards, see write_pooled
+
+    def __init__(self, roifiles, keep_pools=False):
+        self.writers = {}
+        self.pool_blocks = None
+        if keep_pools:
+            self.pool_blocks = {factor: {pool: [] for pool in files if pool != ''} for factor, files in roifiles.items()}
+        try:
+            for factor, files in roifiles.items():
+                self.writers[factor] = {}
+                for pool, filename in files.items():
+                    self.writers[factor][pool] = SleuthWriter(filename)
+        except OSError:
+            self.close()
+            raise
+
+    def write_study(self, study):
+        for factor, writers in self.writers.items():
+            for block in getattr(study, factor):
+                checked = sleuth_block(format_sleuth_block(study, block))
+                writers[''].write_block(checked)
+                # and if MDD, PTSD, SZ or BD, also write to separate file
+                if block.pool != '' and block.pool in writers:
+                    writers[block.pool].write_block(checked)
+                    if self.pool_blocks is not None:
+                        self.pool_blocks[factor][block.pool].append(checked)
+
+    def pools(self, factor):
+        # the disorder pools with their own file for this factor
+        return [pool for pool in self.writers[factor] if pool != '']
+
+    def write_pooled(self, factor, pools, filename):
+        # pooled file for contrast analyses, e.g. pools=('PTSD', 'MDD'):  every PTSD block, then every MDD block -
+        # the same as concatenating the per-disorder files, without reading them back in
+        with SleuthWriter(filename) as f:
+            for pool in pools:
+                for checked in self.pool_blocks[factor][pool]:
+                    f.write_block(checked)
+        return f
+
+    def __iter__(self):
+        for writers in self.writers.values():
+            yield from writers.values()
+
+    def close(self):
+        for writer in self:
+            writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def contrast_pools(disorders, subsets=(), leave_one_out=False, known=None):
+    # Which disorders to pool for contrast analyses:  every pair (in the order of disorders),
+    # then any user-defined subsets, then, if leave_one_out, every disorder but one.  Duplicates are dropped
+    # known, if given, are the disorder pools that have files (e.g. SleuthOutputs.pools(factor));  any other name is an error
+    pools = list(itertools.combinations(disorders, 2))
+    pools += [tuple(subset) for subset in subsets]
+    if leave_one_out:
+        pools += [tuple(d for d in disorders if d != left_out) for left_out in disorders]
+    if known is not None:
+        for pool in pools:
+            unknown = [disorder for disorder in pool if disorder not in known]
+            if len(unknown) > 0:
+                raise ValueError('unknown disorder ' + ', '.join(repr(disorder) for disorder in unknown) + ' in contrast pool '
+                                 + str(pool) + ';  disorders with their own files are ' + ', '.join(known)
+                                 + ' (DISORDERS in zotero_studies.py, and roifiles)')
+    return list(dict.fromkeys(pools))
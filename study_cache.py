@@ -0,0 +1,68 @@
+# Purpose:
+# Persistent cache of extracted studies, so re-running on a fresh Zotero export only re-parses the records
+# whose notes (or dates, contributors, titles) changed since the last run.
+#
+# Each record is identified by its rec-number, and the cache stores a hash of the record's relevant fields
+# (RECORD_FIELDS in zotero_studies.py) next to the parsed Study object.  Outputs are still rebuilt from all studies.
+# Records that are no longer in the export are dropped when the cache is saved.
+
+import hashlib
+import os
+import pickle
+import xml.etree.ElementTree as ET
+
+from atomic_file import atomic_write
+from zotero_studies import PARSER_VERSION, RECORD_FIELDS, extract_study
+
+
+def record_digest(thisrecord):
+    # hash of everything extract_study reads from this record
+    digest = hashlib.sha1()
+    for child in thisrecord:
+        if child.tag in RECORD_FIELDS:
+            digest.update(ET.tostring(child))
+    return digest.hexdigest()
+
+
+class StudyCache:
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.studies = {}  # record identity -> (digest, study)
+        self.seen = {}  # entries used in this run; only these are saved
+        self.hits = 0
+        self.misses = 0
+        if os.path.exists(filename):
+            with open(filename, 'rb') as f:
+                cached = pickle.load(f)
+            # a cache written by a different version of the parser is ignored
+            if cached.get('parser_version') == PARSER_VERSION:
+                self.studies = cached['studies']
+
+    def lookup(self, thisrecord):
+        # returns (identity, digest, study);  study is None if the record is new or changed
+        digest = record_digest(thisrecord)
+        identity = thisrecord.findtext('rec-number') or digest
+        cached = self.studies.get(identity)
+        if cached is not None and cached[0] == digest:
+            self.hits += 1
+            return identity, digest, cached[1]
+        self.misses += 1
+        return identity, digest, None
+
+    def store(self, identity, digest, study):
+        self.seen[identity] = (digest, study)
+
+    def extract(self, thisrecord):
+        identity, digest, study = self.lookup(thisrecord)
+        if study is None:
+            study = extract_study(thisrecord)
+        self.store(identity, digest, study)
+        return study
+
+    def save(self):
+        def write(temp_filename):
+            with open(temp_filename, 'wb') as f:
+                pickle.dump({'parser_version': PARSER_VERSION, 'studies': self.seen}, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        atomic_write(self.filename, write)
@@ -0,0 +1,118 @@
+# Purpose:
+# Columnar catalog of every record in the library, written once per run, so later analyses (PRISMA counts,
+# per-disorder statistics, duplicates) can load just the columns they need instead of re-running the xml pipeline.
+#
+# Three tables, saved together in one .npz file (one array per column, each loaded only when asked for):
+#   study     one row per record:  rec_number, author, year, title, N, included/excluded, disorder and pool flags,
+#             number of blocks and foci per factor, non-MNI/TT blocks, malformed lines, number of notes entries
+#   criteria  one row per reason for inclusion or exclusion:  study (row in the study table), kind, text
+#   foci      the CoordinateTable of every focus (see coordinate_store.py);  its study column is the row in the study table
+#
+# Note, needs numpy (only imported when the catalog is used).  Parquet would need pyarrow, which the pipeline
+# doesn't otherwise use, so the catalog uses the same .npz format as the coordinate store
+
+import numpy as np
+
+from coordinate_store import COLUMNS, EXPERIMENT_COLUMNS, CoordinateTable, CoordinateTableBuilder, parse_sample_size
+from zotero_studies import DISORDERS, FACTORS, disorder_pool
+
+STUDY_COLUMNS = (['rec_number', 'author', 'year', 'title', 'N', 'included', 'excluded', 'has_notes', 'entries', 'disorder', 'pool']
+                 + ['flag_' + disorder for disorder in DISORDERS]
+                 + [factor + suffix for factor in FACTORS for suffix in ('_blocks', '_foci', '_nonMNIorTT')]
+                 + ['malformed'])
+CRITERIA_COLUMNS = ['study', 'kind', 'text']
+STRING_COLUMNS = {'rec_number', 'author', 'year', 'title', 'disorder', 'pool', 'kind', 'text'}
+
+
+def column_array(name, values):
+    if name in STRING_COLUMNS:
+        return np.asarray(values, dtype=str)
+    if name in ('included', 'excluded', 'has_notes') or name.startswith('flag_'):
+        return np.asarray(values, dtype=bool)
+    return np.asarray(values, dtype=np.int32)
+
+
+class StudyCatalogBuilder:
+    # Accumulates the catalog study by study, alongside the Sleuth/GingerALE output
+
+    def __init__(self, foci_builder=None):
+        self.study = {name: [] for name in STUDY_COLUMNS}
+        self.criteria = {name: [] for name in CRITERIA_COLUMNS}
+        # the foci table is also the coordinate store, if one is wanted (study column = row in the study table)
+        self.foci_builder = foci_builder if foci_builder is not None else CoordinateTableBuilder()
+
+    def add_study(self, study):
+        row = len(self.study['rec_number'])
+        self.foci_builder.add_study(study)
+        # None (missing field) is stored as an empty string
+        columns = self.study
+        columns['rec_number'].append(study.rec_number or '')
+        columns['author'].append(study.author or '')
+        columns['year'].append(study.year or '')
+        columns['title'].append(study.title or '')
+        columns['N'].append(parse_sample_size(study.N))
+        columns['included'].append(study.included)
+        columns['excluded'].append(study.excluded)
+        columns['has_notes'].append(study.has_notes)
+        columns['entries'].append(study.entries)
+        columns['disorder'].append(study.disorder or '')
+        for disorder in DISORDERS:
+            columns['flag_' + disorder].append(study.flags[disorder] == 1)
+        columns['pool'].append(disorder_pool(study.flags))
+        for factor in FACTORS:
+            blocks = getattr(study, factor)
+            columns[factor + '_blocks'].append(len(blocks))
+            columns[factor + '_foci'].append(sum(len(block.coordinates) for block in blocks))
+            columns[factor + '_nonMNIorTT'].append(study.nonMNIorTT[factor])
+        columns['malformed'].append(len(study.malformed))
+        for kind, entry in study.criteria:
+            self.criteria['study'].append(row)
+            self.criteria['kind'].append(kind)
+            self.criteria['text'].append(entry)
+        return study
+
+    def build(self):
+        return StudyCatalog({name: column_array(name, values) for name, values in self.study.items()},
+                            {name: column_array(name, values) for name, values in self.criteria.items()},
+                            self.foci_builder.build())
+
+
+class StudyCatalog:
+
+    def __init__(self, study, criteria=None, foci=None):
+        self.study = study  # column name -> array, one row per record
+        self.criteria = criteria if criteria is not None else {}
+        self.foci = foci
+
+    def __len__(self):
+        return len(next(iter(self.study.values()))) if self.study else 0
+
+    def __getitem__(self, name):
+        return self.study[name]
+
+    def save(self, filename):
+        arrays = {'study.' + name: values for name, values in self.study.items()}
+        arrays.update({'criteria.' + name: values for name, values in self.criteria.items()})
+        if self.foci is not None:
+            arrays.update({'foci.' + name: getattr(self.foci, name) for name in COLUMNS + EXPERIMENT_COLUMNS})
+        np.savez(filename, **arrays)
+
+    @classmethod
+    def load(cls, filename, columns=None, criteria=False, foci=False):
+        # columns:  study columns to load (default all);  criteria and foci tables are only loaded if asked for
+        with np.load(filename) as data:
+            names = columns if columns is not None else [key[len('study.'):] for key in data.files if key.startswith('study.')]
+            study = {name: data['study.' + name] for name in names}
+            criteria_table = {name: data['criteria.' + name] for name in CRITERIA_COLUMNS} if criteria else None
+            foci_table = CoordinateTable(**{name: data['foci.' + name] for name in COLUMNS + EXPERIMENT_COLUMNS}) if foci else None
+        return cls(study, criteria_table, foci_table)
+
+    def prisma_counts(self):
+        # numbers of records, included and excluded articles, and records with empty notes
+        return {
+            'records': len(self),
+            'included': int(self.study['included'].sum()),
+            'excluded': int(self.study['excluded'].sum()),
+            'neither': int((~self.study['included'] & ~self.study['excluded']).sum()),
+            'empty notes': int((~self.study['has_notes']).sum()),
+        }
@@ -0,0 +1,97 @@
+# Purpose:
+# Synthetic Zotero libraries for benchmarks and offline checks, in the same xml shape the pipeline reads
+# (xml/records/record with rec-number, contributors, titles, dates and research-notes).
+#
+# research-notes follow the lab's annotation conventions:  1st/2nd pass keep or exclude, '4th disease ...',
+# N=xxx, '4th resilience MNI' / '3rd susceptibility TT' headers followed by 'label x y z' lines, '4th note ...'.
+# Record count, notes length (extra free-text lines), foci per study and &nbsp; noise can all be varied.
+# Records are written one at a time, so even 1M-record libraries don't need much memory.
+#
+# usage:
+#   python synthetic_library.py library.xml 10000 [--seed 1] [--foci 8] [--notes 0] [--nbsp 0.1]
+
+import argparse
+import random
+from xml.sax.saxutils import escape
+
+AUTHORS = ['Smith', 'Lee', 'Garcia', 'Chen', 'Müller', 'Okafor', 'Nguyen', 'Rossi']
+DISEASES = ['PTSD', 'MDD', 'depression', 'schizophrenia', 'bipolar', 'anxiety', 'healthy']
+EXCLUSIONS = ['exclude sample nonhuman', 'exclude review', 'exclude def', 'exclude cognitive reserve', 'exclude no coord',
+              'exclude paywall', 'exclude behavioral only', 'exclude no data', 'exclude case study']
+SPACES = [' MNI', ' MNI', ' TT', ' freesurfer']
+
+
+def coordinate_lines(rng, n, nbsp):
+    lines = []
+    for _ in range(n):
+        separator = '&nbsp;' if rng.random() < nbsp else ' '
+        xyz = [str(rng.randint(-70, 70)), str(rng.randint(-100, 70)), str(rng.randint(-50, 80))]
+        lines.append(separator.join(['roi'] + xyz))
+    return lines
+
+
+def research_notes(rng, foci=8, notes=0, nbsp=0.1):
+    # one record's research-notes lines, or None for a record with no notes.
+    # foci is the largest number of foci per block, notes the number of extra free-text lines
+    r = rng.random()
+    if r < 0.03:
+        return None
+    if r < 0.3:
+        lines = ['1st ' + rng.choice(EXCLUSIONS)]
+    else:
+        lines = ['1st keep', '2nd keep', '4th disease ' + rng.choice(DISEASES)]
+        if rng.random() < 0.9:
+            lines.append('N=' + str(rng.randint(10, 400)) + ('&nbsp;' if rng.random() < nbsp else ''))
+        for factor in rng.sample(['resilience', 'susceptibility'], rng.randint(1, 2)):
+            lines.append(rng.choice(['4th ', '3rd ']) + factor + rng.choice(SPACES))
+            lines += coordinate_lines(rng, rng.randint(1, foci), nbsp)
+        if rng.random() < 0.2:
+            lines.append('4th note coordinates from table 2')
+    lines += ['2nd comment ' + ' '.join(rng.choice(['region', 'effect', 'cohort', 'scan', 'task']) for _ in range(8))
+              for _ in range(notes)]
+    if rng.random() < 0.3:
+        lines.append('Accessed ' + str(rng.randint(2015, 2024)))
+    return lines
+
+
+def format_record(rec_number, author, year, title, notes):
+    parts = ['<record><rec-number>' + str(rec_number) + '</rec-number>',
+             '<contributors><authors><author>' + escape(author) + ', A.</author></authors></contributors>',
+             '<titles><title>' + escape(title) + '</title></titles>',
+             '<dates><year>' + year + '</year></dates>']
+    if notes is not None:
+        # Zotero separates lines of a note with two carriage returns
+        parts.append('<research-notes>' + '&#13;&#13;'.join(escape(line) for line in notes) + '</research-notes>')
+    parts.append('</record>\n')
+    return ''.join(parts)
+
+
+def iter_records(records, seed=1, foci=8, notes=0, nbsp=0.1):
+    # xml text of each synthetic record
+    rng = random.Random(seed)
+    for i in range(records):
+        author = rng.choice(AUTHORS)
+        year = str(rng.randint(1995, 2024))
+        title = 'Neural correlates of resilience, study ' + str(rng.randint(0, max(records // 2, 1)))
+        yield format_record(i + 1, author, year, title, research_notes(rng, foci=foci, notes=notes, nbsp=nbsp))
+
+
+def write_library(filename, records, seed=1, foci=8, notes=0, nbsp=0.1):
+    with open(filename, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<xml><records>\n')
+        for text in iter_records(records, seed=seed, foci=foci, notes=notes, nbsp=nbsp):
+            f.write(text)
+        f.write('</records></xml>\n')
+    return filename
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a synthetic Zotero xml library')
+    parser.add_argument('filename')
+    parser.add_argument('records', type=int)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--foci', type=int, default=8, help='largest number of foci per coordinate block')
+    parser.add_argument('--notes', type=int, default=0, help='extra free-text lines per record')
+    parser.add_argument('--nbsp', type=float, default=0.1, help='fraction of lines using &nbsp; instead of spaces')
+    args = parser.parse_args()
+    write_library(args.filename, args.records, seed=args.seed, foci=args.foci, notes=args.notes, nbsp=args.nbsp)
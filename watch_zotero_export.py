@@ -0,0 +1,136 @@
+# Purpose:
+# Watch mode:  keep the Sleuth/GingerALE files and counts up to date while the Zotero library is being annotated.
+# Every time the export is saved again, the pipeline is re-run and only the output files whose content changed are
+# replaced, so open GingerALE sessions and file syncs don't see files that were merely rewritten.
+#
+#   - the export is polled (size and modification time);  after a change, we wait until it has stopped changing
+#     for debounce seconds, so a half-written export isn't read
+#   - records are re-extracted only if they changed since the last round (a study cache, see study_cache.py,
+#     kept in the output directory as .study_cache.pickle);  with ma_cache_dir set, the MA map cache of the built-in
+#     ALE is also kept in the output directory, so it carries over from round to round
+#   - outputs are written to a staging directory first;  each one that differs from the current file is moved
+#     into place with os.replace (atomic), the others are left untouched
+#   - the printed report of each round goes to log.txt in the output directory
+#
+# usage:
+#   python watch_zotero_export.py Resilience_Systematic_Review.xml output_dir [--interval 1] [--debounce 2]
+
+import argparse
+import contextlib
+import filecmp
+import os
+import shutil
+import time
+import xml.etree.ElementTree as ET
+
+import import_zotero_xml_output_all as pipeline
+from pipeline_stats import PipelineStats
+
+STAGING = '.staging'
+CACHE = '.study_cache.pickle'
+
+
+def export_signature(xml_filename):
+    # changes whenever the export is saved again;  None while the file doesn't exist (e.g. mid-export)
+    try:
+        stat = os.stat(xml_filename)
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def wait_until_stable(xml_filename, signature, debounce, interval):
+    # returns the export's signature once it hasn't changed for debounce seconds
+    stable_since = time.monotonic()
+    while time.monotonic() - stable_since < debounce:
+        time.sleep(interval)
+        current = export_signature(xml_filename)
+        if current != signature:
+            signature = current
+            stable_since = time.monotonic()
+    return signature
+
+
+def publish_changed(dir_staging, dir_output, prefix=''):
+    # move each staged file that differs from the current output into place;  returns the names of replaced files.
+    # Subdirectories (e.g. the ALE maps) are published file by file, the same way
+    replaced = []
+    for name in sorted(os.listdir(dir_staging)):
+        staged = os.path.join(dir_staging, name)
+        target = os.path.join(dir_output, name)
+        if os.path.isdir(staged):
+            os.makedirs(target, exist_ok=True)
+            replaced += publish_changed(staged, target, prefix + name + '/')
+            os.rmdir(staged)
+        elif os.path.exists(target) and filecmp.cmp(staged, target, shallow=False):
+            os.remove(staged)
+        else:
+            os.replace(staged, target)
+            replaced.append(prefix + name)
+    return replaced
+
+
+def regenerate(xml_filename, dir_output):
+    # one round of the pipeline into the staging directory;  returns (replaced files, PipelineStats)
+    dir_staging = os.path.join(dir_output, STAGING)
+    if os.path.exists(dir_staging):
+        shutil.rmtree(dir_staging)
+    os.makedirs(dir_staging)
+    # the study cache and the MA map cache live next to the outputs, not in the staging directory
+    pipeline.study_cache_file = os.path.abspath(os.path.join(dir_output, CACHE))
+    if pipeline.ma_cache_dir is not None:
+        pipeline.ma_cache_dir = os.path.abspath(os.path.join(dir_output, pipeline.ma_cache_dir))
+    stats = PipelineStats()
+    with open(os.path.join(dir_staging, 'log.txt'), 'w', encoding='utf-8') as log, contextlib.redirect_stdout(log):
+        pipeline.run(xml_filename, dir_staging, stats=stats)
+    # warnings in the log name the files where they will end up
+    log_filename = os.path.join(dir_staging, 'log.txt')
+    with open(log_filename, encoding='utf-8') as f:
+        report = f.read()
+    with open(log_filename, 'w', encoding='utf-8') as f:
+        f.write(report.replace(dir_staging, dir_output))
+    replaced = publish_changed(dir_staging, dir_output)
+    os.rmdir(dir_staging)
+    return replaced, stats
+
+
+def watch(xml_filename, dir_output, interval=1.0, debounce=2.0, rounds=None):
+    # runs until interrupted (or for the given number of rounds)
+    xml_filename = os.path.abspath(xml_filename)
+    dir_output = os.path.abspath(dir_output)
+    os.makedirs(dir_output, exist_ok=True)
+    print('Watching ' + xml_filename + ' (Ctrl+C to stop)')
+    last = None
+    done = 0
+    while rounds is None or done < rounds:
+        signature = export_signature(xml_filename)
+        if signature is not None and signature != last:
+            signature = wait_until_stable(xml_filename, signature, debounce, interval)
+            last = signature
+            start = time.perf_counter()
+            try:
+                replaced, stats = regenerate(xml_filename, dir_output)
+            except ET.ParseError as error:
+                # most likely still being exported;  try again once the file changes
+                print(time.strftime('%H:%M:%S') + '  could not read the export (' + str(error) + '), waiting for the next change')
+                continue
+            counters = stats.counters
+            print(time.strftime('%H:%M:%S') + '  re-extracted ' + str(counters.get('cache misses', 0)) + ' of '
+                  + str(counters.get('records', 0)) + ' records in ' + '%.2f' % (time.perf_counter() - start) + ' s;  '
+                  + ('updated ' + ', '.join(replaced) if replaced else 'no output files changed'))
+            done += 1
+            continue
+        time.sleep(interval)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Regenerate the Sleuth/GingerALE files whenever the Zotero export changes')
+    parser.add_argument('xml_filename')
+    parser.add_argument('dir_output')
+    parser.add_argument('--interval', type=float, default=1.0, help='seconds between checks of the export')
+    parser.add_argument('--debounce', type=float, default=2.0, help='seconds the export must be unchanged before re-running')
+    args = parser.parse_args()
+    try:
+        watch(args.xml_filename, args.dir_output, interval=args.interval, debounce=args.debounce)
+    except KeyboardInterrupt:
+        pass
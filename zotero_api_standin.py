@@ -0,0 +1,195 @@
+# Purpose:
+# Local stand-in for the Zotero API, to try zotero_local_api.py offline (no Zotero, no network).
+# Serves the parts of web API v3 the pipeline uses:  top-level items and child notes (/items/top, /items?itemType=note),
+# pagination (start/limit, Total-Results, Link), library versions (Last-Modified-Version, ?since=,
+# If-Modified-Since-Version -> 304 Not Modified), the trash (includeTrashed) and deletions (/deleted, format=keys).
+# Runs http.server on a background thread, with HTTP/1.1 keep-alive;  delay slows down every response, to see
+# what concurrent requests buy on a remote library.
+#
+# The library is made from an xml export (e.g. one written by synthetic_library.py):  one item per record and one
+# child note per research-notes field, so pulling it gives the same studies as reading the export.
+# Items and notes can then be edited, trashed or deleted, to check that the next pull only gets the changes
+# (check_zotero_api.py does all of this).
+#
+# usage:
+#   python zotero_api_standin.py library.xml [--port 23119] [--delay 0]
+
+import argparse
+import json
+import threading
+import time
+import xml.etree.ElementTree as ET
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlsplit
+from xml.sax.saxutils import escape
+
+from zotero_studies import iter_records, record_fields
+
+PREFIX = '/api/users/0'
+KEY_CHARACTERS = '23456789ABCDEFGHIJKLMNPQRSTUVWXYZ'  # Zotero keys are 8 of these
+DEFAULT_LIMIT = 25
+MAX_LIMIT = 100
+
+
+def note_html(lines):
+    # a note as Zotero stores it:  one paragraph per line (&nbsp; in the text is a non-breaking space in the note)
+    return ('<div data-schema-version="8">'
+            + ''.join('<p>' + escape(line).replace('&amp;nbsp;', '&nbsp;') + '</p>\n' for line in lines) + '</div>')
+
+
+class StandinLibrary:
+
+    def __init__(self):
+        self.version = 0  # library version, bumped by every change
+        self.objects = {}  # key -> data of every item and note
+        self.deleted = {}  # key -> library version it was deleted in
+        self.added = 0
+        self.lock = threading.Lock()
+
+    def new_key(self):
+        n = len(self.objects) + len(self.deleted)
+        key = ''
+        for _ in range(8):
+            n, digit = divmod(n, len(KEY_CHARACTERS))
+            key = KEY_CHARACTERS[digit] + key
+        return key
+
+    def store(self, data):
+        with self.lock:
+            self.version += 1
+            data['version'] = self.version
+            if 'key' not in data:
+                data['key'] = self.new_key()
+                # one second apart, so the order items were added in is the order of the export
+                data['dateAdded'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(1704067200 + self.added))
+                self.added += 1
+            self.objects[data['key']] = data
+        return data['key']
+
+    def add_item(self, author, year, title, notes=()):
+        # notes:  the lines of each child note
+        key = self.store({'itemType': 'journalArticle', 'title': title or '', 'date': year or '',
+                          'creators': [{'creatorType': 'author', 'lastName': author, 'firstName': 'A.'}]})
+        for lines in notes:
+            self.add_note(key, lines)
+        return key
+
+    def add_note(self, parent, lines):
+        return self.store({'itemType': 'note', 'parentItem': parent, 'note': note_html(lines)})
+
+    def edit(self, key, **fields):
+        self.store(dict(self.objects[key], **fields))
+
+    def set_note(self, key, lines):
+        self.edit(key, note=note_html(lines))
+
+    def children(self, key):
+        return sorted(data['key'] for data in self.objects.values() if data.get('parentItem') == key)
+
+    def trash(self, key):
+        self.edit(key, deleted=1)
+
+    def delete(self, key):
+        # deleting an item deletes its child notes too
+        children = self.children(key)
+        with self.lock:
+            self.version += 1
+            for deleted_key in [key] + children:
+                del self.objects[deleted_key]
+                self.deleted[deleted_key] = self.version
+
+    @classmethod
+    def from_xml(cls, xml_filename):
+        library = cls()
+        for thisrecord in iter_records(ET.parse(xml_filename).getroot()):
+            author, year, title, _, research_notes = record_fields(thisrecord)
+            library.add_item(author, year, title, [line.split('\r\r') for line in research_notes])
+        return library
+
+    def listing(self, top, params):
+        # items (and notes) matching a request, in the order they were added
+        since = int(params.get('since', 0))
+        include_trashed = params.get('includeTrashed') == '1'
+        item_type = params.get('itemType')
+        with self.lock:
+            objects = [data for data in self.objects.values()
+                       if data['version'] > since and (include_trashed or not data.get('deleted'))
+                       and not (top and data.get('parentItem')) and (item_type is None or data['itemType'] == item_type)]
+        return sorted(objects, key=lambda data: (data['dateAdded'], data['key']))
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+    library = None
+    delay = 0.0
+
+    def send(self, status, body=b'', content_type='application/json', headers=()):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Last-Modified-Version', str(self.library.version))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.delay > 0:
+            time.sleep(self.delay)
+        parts = urlsplit(self.path)
+        params = dict(parse_qsl(parts.query))
+        route = parts.path[len(PREFIX):] if parts.path.startswith(PREFIX) else None
+        if route not in ('/items', '/items/top', '/deleted'):
+            self.send(404, b'Not found', 'text/plain')
+            return
+        if int(self.headers.get('If-Modified-Since-Version', -1)) >= self.library.version:
+            self.send(304)
+            return
+
+        if route == '/deleted':
+            since = int(params.get('since', 0))
+            deleted = sorted(key for key, version in self.library.deleted.items() if version > since)
+            body = {'collections': [], 'searches': [], 'items': deleted, 'tags': [], 'settings': []}
+            self.send(200, json.dumps(body).encode())
+            return
+
+        objects = self.library.listing(route == '/items/top', params)
+        if params.get('format') == 'keys':
+            self.send(200, ''.join(data['key'] + '\n' for data in objects).encode(), 'text/plain')
+            return
+        start = int(params.get('start', 0))
+        limit = min(int(params.get('limit', DEFAULT_LIMIT)), MAX_LIMIT)
+        page = [{'key': data['key'], 'version': data['version'], 'library': {'type': 'user', 'id': 0}, 'data': data}
+                for data in objects[start:start + limit]]
+        headers = [('Total-Results', str(len(objects)))]
+        if start + limit < len(objects):
+            next_params = urlencode(dict(params, start=start + limit, limit=limit))
+            headers.append(('Link', '<' + parts.path + '?' + next_params + '>; rel="next"'))
+        self.send(200, json.dumps(page).encode(), headers=headers)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(library, host='127.0.0.1', port=0, delay=0.0, handler=StandinHandler):
+    # starts the stand-in on a background thread (port 0 picks a free one);  returns the server and the API url.
+    # Stop it with server.shutdown()
+    handler = type('Handler', (handler,), {'library': library, 'delay': delay})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://' + host + ':' + str(server.server_address[1]) + PREFIX
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve an xml export as a stand-in for the Zotero local API')
+    parser.add_argument('xml_filename')
+    parser.add_argument('--port', type=int, default=23119)
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds added to every response')
+    args = parser.parse_args()
+    server, url = serve(StandinLibrary.from_xml(args.xml_filename), port=args.port, delay=args.delay)
+    print('Serving ' + args.xml_filename + ' at ' + url + ' (Ctrl+C to stop)')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,339 @@
+# Purpose:
+# Pull the library straight from Zotero instead of exporting it to xml by hand first.
+# Talks to the local API of the Zotero 7 desktop app (http://localhost:23119/api/users/0, enable it under
+# Settings > Advanced > "Allow other applications on this computer to communicate with Zotero"), or to the
+# web API (https://api.zotero.org/users/<id>, with an API key) - both speak Zotero web API v3.
+#
+#   - requests run concurrently with asyncio over a small pool of keep-alive connections
+#   - multi-object requests are paginated:  the first page gives Total-Results, the other pages are fetched together
+#   - the library version of the last pull is kept, so the next pull sends If-Modified-Since-Version
+#     (304 Not Modified if nothing changed at all) and only asks for items and notes changed since then
+#     (?since=), plus the keys deleted since then
+#   - child notes are converted from html to the text the xml export has (lines separated by \r\r, &nbsp; kept),
+#     and each item goes through the same extraction as an xml record (zotero_studies.study_from_fields)
+#   - items, notes and extracted studies are saved in a state file between runs, so an unchanged item is
+#     neither downloaded nor re-extracted again
+#
+# Only the standard library is used (asyncio streams, no aiohttp).  See zotero_api_standin.py for a local
+# stand-in server to try this offline.
+#
+# usage, as a library (or set zotero_api_url in import_zotero_xml_output_all.py):
+#   library, pool = pull_library('http://localhost:23119/api/users/0', 'zotero_api_state.pickle')
+#   studies = library.extract_studies()
+#   library.save()
+
+import asyncio
+import html
+import json
+import os
+import pickle
+import re
+import ssl
+from urllib.parse import urlencode, urlsplit
+
+from atomic_file import atomic_write
+from zotero_studies import PARSER_VERSION, study_from_fields
+
+LOCAL_API = 'http://localhost:23119/api/users/0'
+PAGE_SIZE = 100  # largest page the API allows
+RETRIES = 3
+# top-level items that aren't articles
+SKIP_ITEM_TYPES = ('note', 'attachment', 'annotation')
+
+# a note's html, split into lines where the xml export starts a new line
+NOTE_LINE_BREAK = re.compile(r'</p>|<br\s*/?>|</div>|</h\d>|</li>|</pre>|</blockquote>', re.IGNORECASE)
+HTML_TAG = re.compile(r'<[^>]*>')
+
+
+class ZoteroAPIError(Exception):
+    pass
+
+
+class LibraryChanged(Exception):
+    # the library version changed between pages of one pull;  the pull is started again
+    pass
+
+
+async def read_response(reader):
+    # one HTTP/1.1 response:  (status, headers with lower case names, body, whether the connection can be reused)
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionResetError('connection closed by the server')
+    version, status = status_line.decode('latin-1').split()[:2]
+    status = int(status)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+    if status in (204, 304) or 100 <= status < 200:
+        body = b''
+    elif 'chunked' in headers.get('transfer-encoding', '').lower():
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass  # trailers
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readline()
+        body = b''.join(chunks)
+    elif 'content-length' in headers:
+        body = await reader.readexactly(int(headers['content-length']))
+    else:
+        # body runs until the server closes the connection
+        body = await reader.read()
+        keep_alive = False
+    return status, headers, body, keep_alive
+
+
+class ConnectionPool:
+    # at most size keep-alive connections to the API;  requests beyond that wait for a free connection
+
+    def __init__(self, url, size=4, api_key=None, timeout=60.0):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.ssl = ssl.create_default_context() if parts.scheme == 'https' else None
+        self.base_path = parts.path.rstrip('/')
+        self.headers = {'Host': parts.netloc, 'Zotero-API-Version': '3', 'Accept': 'application/json', 'Connection': 'keep-alive'}
+        if api_key is not None:
+            self.headers['Zotero-API-Key'] = api_key
+        self.size = size
+        self.timeout = timeout
+        self.semaphore = None  # made in the event loop, on first use
+        self.idle = []  # (reader, writer) of open connections not in use
+        self.connections = 0  # connections opened
+        self.requests = 0
+
+    async def connect(self):
+        self.connections += 1
+        return await asyncio.wait_for(asyncio.open_connection(self.host, self.port, ssl=self.ssl), self.timeout)
+
+    async def get(self, path, params=None, headers=None):
+        # GET base path + path;  returns (status, headers, body)
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.size)
+        target = self.base_path + path + ('?' + urlencode(params) if params else '')
+        request_headers = dict(self.headers, **(headers or {}))
+        request = ('GET ' + target + ' HTTP/1.1\r\n'
+                   + ''.join(name + ': ' + value + '\r\n' for name, value in request_headers.items()) + '\r\n').encode('latin-1')
+        async with self.semaphore:
+            for attempt in range(RETRIES):
+                reused = len(self.idle) > 0
+                reader, writer = self.idle.pop() if reused else await self.connect()
+                try:
+                    writer.write(request)
+                    await writer.drain()
+                    status, response_headers, body, keep_alive = await asyncio.wait_for(read_response(reader), self.timeout)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    writer.close()
+                    if reused:
+                        continue  # the server closed a connection that was idle;  try again on a new one
+                    raise
+                except asyncio.TimeoutError:
+                    writer.close()
+                    raise
+                if keep_alive:
+                    self.idle.append((reader, writer))
+                else:
+                    writer.close()
+                self.requests += 1
+                if status in (429, 503) and 'retry-after' in response_headers:
+                    # rate limited (web API):  wait as long as asked, then try again
+                    await asyncio.sleep(float(response_headers['retry-after']))
+                    continue
+                return status, response_headers, body
+        raise ZoteroAPIError('no response for ' + target + ' after ' + str(RETRIES) + ' attempts')
+
+    async def get_json(self, path, params=None, version=None):
+        # (headers, decoded json) of a request, or None if version is given and the library hasn't changed since
+        headers = {'If-Modified-Since-Version': str(version)} if version else None
+        status, response_headers, body = await self.get(path, params, headers)
+        if status == 304:
+            return None
+        if status != 200:
+            raise ZoteroAPIError(str(status) + ' for ' + path + ':  ' + body.decode('utf-8', 'replace')[:200])
+        return response_headers, json.loads(body)
+
+    async def close(self):
+        for _, writer in self.idle:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+        self.idle = []
+
+
+async def get_pages(pool, path, params, version=None, page_size=PAGE_SIZE):
+    # every object of a multi-object request:  (library version, objects), or None if not modified since version.
+    # The first page says how many objects there are (Total-Results);  the remaining pages are requested all at once
+    # (the pool limits how many run at the same time) rather than following the Link: rel="next" header one by one
+    first = await pool.get_json(path, dict(params, start=0, limit=page_size), version)
+    if first is None:
+        return None
+    headers, objects = first
+    library_version = headers.get('last-modified-version')
+    total = int(headers.get('total-results', len(objects)))
+    pages = await asyncio.gather(*[pool.get_json(path, dict(params, start=start, limit=page_size))
+                                   for start in range(page_size, total, page_size)])
+    for page_headers, page in pages:
+        if page_headers.get('last-modified-version') != library_version:
+            raise LibraryChanged()
+        objects += page
+    return int(library_version), objects
+
+
+def note_lines(note):
+    # a note's html as the xml export has it:  one line per paragraph (or <br>), no tags, and non-breaking spaces
+    # written as &nbsp; (study_from_fields cleans those up, as for the export)
+    text = NOTE_LINE_BREAK.sub('\r\r', note.replace('\r', '').replace('\n', ''))
+    text = html.unescape(HTML_TAG.sub('', text)).replace('\xa0', '&nbsp;')
+    return text.rstrip('\r')
+
+
+def item_fields(item, notes):
+    # same fields as zotero_studies.record_fields gets from an xml record
+    creators = item.get('creators', [])
+    authors = [creator for creator in creators if creator.get('creatorType') == 'author'] or creators
+    if len(authors) == 0:
+        author = 'BLANK'
+    else:
+        author = (authors[0].get('lastName') or authors[0].get('name', '')).split(',')[0]
+    year = re.search(r'\d{4}', item.get('date', ''))
+    return author, year.group() if year else None, item.get('title') or None, item['key'], [note_lines(note['note']) for note in notes]
+
+
+def added(data):
+    return data.get('dateAdded', ''), data['key']
+
+
+class ZoteroLibrary:
+    # local copy of a Zotero library:  top-level items and their child notes (the 'data' of each API object),
+    # brought up to date by pull(), and the study extracted from each item
+
+    def __init__(self, state_file=None):
+        self.state_file = state_file
+        self.version = 0  # library version of the last pull, 0 if never pulled
+        self.items = {}  # key -> item data
+        self.notes = {}  # key -> note data (child notes only)
+        self.extracted = {}  # item key -> ((item version, note versions), study)
+        self.changed = 0  # items and notes downloaded (or deleted) by the last pull
+        self.hits = 0
+        self.misses = 0
+        if state_file is not None and os.path.exists(state_file):
+            with open(state_file, 'rb') as f:
+                state = pickle.load(f)
+            self.version, self.items, self.notes = state['version'], state['items'], state['notes']
+            # studies extracted by a different version of the parser are extracted again (the items are still fine)
+            if state.get('parser_version') == PARSER_VERSION:
+                self.extracted = state['extracted']
+
+    async def pull(self, pool, page_size=PAGE_SIZE):
+        for attempt in range(RETRIES):
+            try:
+                return await self.pull_once(pool, page_size)
+            except LibraryChanged:
+                continue  # edited in Zotero while we were downloading;  start over from the same version
+        raise ZoteroAPIError('the library kept changing during the download, try again later')
+
+    async def pull_once(self, pool, page_size):
+        since = self.version
+        params = {'format': 'json', 'includeTrashed': 1}
+        if since:
+            params['since'] = since
+        top, notes = await asyncio.gather(get_pages(pool, '/items/top', params, since, page_size),
+                                          get_pages(pool, '/items', dict(params, itemType='note'), since, page_size))
+        if top is None and notes is None:
+            self.changed = 0
+            return 0  # 304:  nothing changed since the last pull
+        if top is None or notes is None or top[0] != notes[0]:
+            raise LibraryChanged()
+        version = top[0]
+        deleted = await self.deleted_keys(pool, since) if since else set()
+
+        for obj in top[1]:
+            data = obj['data']
+            if data.get('deleted') or data.get('itemType') in SKIP_ITEM_TYPES:
+                self.items.pop(data['key'], None)  # in the trash, or not an article
+            else:
+                self.items[data['key']] = data
+        for obj in notes[1]:
+            data = obj['data']
+            if data.get('deleted') or not data.get('parentItem'):
+                self.notes.pop(data['key'], None)  # in the trash, or a standalone note
+            else:
+                self.notes[data['key']] = data
+        for key in deleted:
+            self.items.pop(key, None)
+            self.notes.pop(key, None)
+        self.version = version
+        # (a trashed item can also be in deleted, when deletions come from the list of keys)
+        self.changed = len({obj['key'] for obj in top[1] + notes[1]} | deleted)
+        return self.changed
+
+    async def deleted_keys(self, pool, since):
+        # keys of items deleted since the last pull.  If the API has no /deleted (older local API),
+        # anything we have that is no longer in the library's list of keys
+        status, _, body = await pool.get('/deleted', {'since': since, 'format': 'json'})
+        if status == 200:
+            return set(json.loads(body).get('items', []))
+        status, _, body = await pool.get('/items', {'format': 'keys'})
+        if status != 200:
+            raise ZoteroAPIError(str(status) + ' for the list of item keys')
+        return (set(self.items) | set(self.notes)) - set(body.decode('utf-8').split())
+
+    def records(self):
+        # (item key, signature, fields) for every item, in the order they were added to the library
+        children = {}
+        for note in sorted(self.notes.values(), key=added):
+            children.setdefault(note['parentItem'], []).append(note)
+        for item in sorted(self.items.values(), key=added):
+            notes = children.get(item['key'], [])
+            yield item['key'], (item['version'], tuple(note['version'] for note in notes)), item_fields(item, notes)
+
+    def extract_studies(self):
+        # a study for every item, re-using those extracted before for items (and notes) that haven't changed
+        studies = []
+        extracted = {}
+        for key, signature, fields in self.records():
+            cached = self.extracted.get(key)
+            if cached is not None and cached[0] == signature:
+                self.hits += 1
+                study = cached[1]
+            else:
+                self.misses += 1
+                study = study_from_fields(*fields)
+            extracted[key] = (signature, study)
+            studies.append(study)
+        self.extracted = extracted
+        return studies
+
+    def save(self):
+        def write(temp_filename):
+            with open(temp_filename, 'wb') as f:
+                pickle.dump({'parser_version': PARSER_VERSION, 'version': self.version, 'items': self.items, 'notes': self.notes,
+                             'extracted': self.extracted}, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        atomic_write(self.state_file, write)
+
+
+def pull_library(url=LOCAL_API, state_file=None, connections=4, api_key=None, page_size=PAGE_SIZE):
+    # a ZoteroLibrary brought up to date with the API at url (its state loaded from, but not yet saved to, state_file).
+    # Returns the library and the pool, for its counts of requests and connections
+    library = ZoteroLibrary(state_file)
+    pool = ConnectionPool(url, size=connections, api_key=api_key)
+
+    async def pull():
+        try:
+            await library.pull(pool, page_size)
+        finally:
+            await pool.close()
+
+    asyncio.run(pull())
+    return library, pool
@@ -0,0 +1,377 @@
+# Purpose:
+# Single-pass extraction of studies from a Zotero bibliography saved in xml format.
+#
+# import_zotero_xml_output_all.py used to walk every record three times (resilience, susceptibility,
+# and inclusion/exclusion), re-splitting and re-cleaning the research-notes field each time.
+# Here each record is parsed exactly once into a Study object, and every downstream output
+# (Sleuth/GingerALE text files, disorder pools, inclusion/exclusion dictionaries) is built from it.
+#
+# The parsing rules are the same as the original three passes, including the factor-specific
+# header and "stop writing" prefixes, so the generated text files are unchanged.
+# Each line of the notes is classified once by a compiled tokenizer (see compile_line_types).
+
+import re
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass, field, replace
+from typing import List, Optional, Tuple
+
+# each factor has the note prefixes that start a block of coordinates ("4th resilienc* MNI")
+# and the prefixes that turn writing of coordinates back off.
+# Note the asymmetry with the original code: resilience stops on '4th susc', susceptibility on '4th res'
+FACTORS = {
+    'resilience': {
+        'headers': ('4th res', '3rd res'),
+        'stops': ('4th note', '4th susc', '3rd susc', 'Acces', 'N', 'n', '4th sample', '3rd sample'),
+    },
+    'susceptibility': {
+        'headers': ('4th sus', '3rd sus'),
+        'stops': ('4th note', '4th res', '3rd res', 'Acces', 'N', 'n', '4th sample', '3rd sample'),
+    },
+}
+
+# disorders that get their own Sleuth/GingerALE file; order matters (MDD wins over PTSD, etc.)
+DISORDERS = ['MDD', 'PTSD', 'SZ', 'BD']
+
+# prefixes of notes that mark an article as included in the meta-analysis
+INCLUSION_PREFIXES = ('4th res', '3rd res', '4th sus', '3rd sus')
+
+# prefix of the note with the sample size, N=xxx
+SAMPLE_SIZE_PREFIXES = ('n=', 'N=')
+
+# bump whenever the parsing rules (or the Study object) change, so cached studies are re-extracted
+PARSER_VERSION = 3
+
+# the parts of a record that extract_study reads;  a record only needs re-extracting when one of these changes
+RECORD_FIELDS = ('dates', 'contributors', 'titles', 'research-notes')
+
+
+# what a line of research-notes means for each factor:  starts a block of coordinates, stops writing, or neither
+# (a line that neither starts nor stops a block is a coordinate line if that factor is writing)
+HEADER, STOP, LINE = 'header', 'stop', 'line'
+
+
+@dataclass(frozen=True)
+class LineType:
+    actions: Tuple[Tuple[str, str], ...]  # (factor, HEADER/STOP/LINE) for each factor
+    sample_size: bool = False  # N=xxx
+    inclusion: bool = False  # reason for inclusion (a resilience or susceptibility header)
+
+
+def compile_line_types():
+    # Notes tokenizer:  one compiled regex over every prefix in FACTORS (plus sample size and inclusion prefixes),
+    # and a table saying what each prefix means for each factor.  Each line is then classified with a single match,
+    # instead of a ladder of startswith checks for each factor.
+    prefixes = set(SAMPLE_SIZE_PREFIXES) | set(INCLUSION_PREFIXES)
+    for rules in FACTORS.values():
+        prefixes |= set(rules['headers']) | set(rules['stops'])
+
+    line_types = {}
+    for prefix in prefixes:
+        actions = []
+        for factor, rules in FACTORS.items():
+            if prefix.startswith(rules['headers']):
+                actions.append((factor, HEADER))
+            elif prefix.startswith(rules['stops']):
+                actions.append((factor, STOP))
+            else:
+                actions.append((factor, LINE))
+        line_types[prefix] = LineType(tuple(actions), prefix.startswith(SAMPLE_SIZE_PREFIXES), prefix.startswith(INCLUSION_PREFIXES))
+
+    # longest prefix first, so the most specific one wins (e.g. '4th susc' over '4th sus', 'N=' over 'N')
+    pattern = re.compile('|'.join(re.escape(prefix) for prefix in sorted(prefixes, key=lambda prefix: (-len(prefix), prefix))))
+    return pattern, line_types
+
+
+LINE_PATTERN, LINE_TYPES = compile_line_types()
+PLAIN_LINE = LineType(tuple((factor, LINE) for factor in FACTORS))
+
+# returned by parse_coordinate_line for lines that aren't 'label x y z'
+MALFORMED = ()
+
+
+def classify_line(entry):
+    match = LINE_PATTERN.match(entry)
+    return LINE_TYPES[match.group()] if match else PLAIN_LINE
+
+
+def header_reference(entry):
+    # reference space of a '4th resilienc* MNI' style header, None if neither MNI nor TT (e.g. freesurfer)
+    if entry.find(' MNI') > 0:
+        return 'MNI'
+    elif entry.find(' TT') > 0:
+        return 'Talairach'
+    return None
+
+
+def parse_coordinate_line(entry):
+    # coordinate lines are 'label x y z' (anything after z is ignored);  returns (x, y, z) as typed, or MALFORMED
+    entry_split = entry.split()
+    if len(entry_split) < 4:
+        return MALFORMED
+    return entry_split[1], entry_split[2], entry_split[3]
+
+
+@dataclass
+class CoordinateBlock:
+    reference: str  # 'MNI' or 'Talairach'
+    coordinates: List[Tuple[str, str, str]] = field(default_factory=list)  # x, y, z exactly as typed in notes
+    pool: str = ''  # disorder pool (MDD, PTSD, SZ, BD) when the block was finalized, '' if none
+
+
+@dataclass
+class Study:
+    author: str  # first author surname
+    year: Optional[str]
+    title: Optional[str]
+    rec_number: Optional[str] = None  # Zotero record number, identifies the record between exports
+    N: str = '0'  # sample size from N=xxx in research-notes
+    has_notes: bool = False
+    entries: int = 0  # number of lines in research-notes
+    disorder: Optional[str] = None  # third word of the 'diseas*' note, if any
+    flags: dict = field(default_factory=lambda: dict.fromkeys(DISORDERS, 0))
+    resilience: List[CoordinateBlock] = field(default_factory=list)
+    susceptibility: List[CoordinateBlock] = field(default_factory=list)
+    # number of coordinate blocks that were not in MNI or TT space (e.g. Freesurfer, Destrieux atlas)
+    nonMNIorTT: dict = field(default_factory=lambda: dict.fromkeys(FACTORS, 0))
+    # reasons for inclusion/exclusion, in the order they appear in the notes: ('include' or 'exclude', note)
+    criteria: List[Tuple[str, str]] = field(default_factory=list)
+    # lines inside a block of coordinates that aren't 'label x y z', skipped: (factor, note)
+    malformed: List[Tuple[str, str]] = field(default_factory=list)
+
+    @property
+    def nameyeartitle(self):
+        year = 'NoYear' if self.year is None else self.year
+        title = 'No title' if self.title is None else self.title
+        return self.author + '\t' + year + '\t' + title
+
+    @property
+    def included(self):
+        return any(kind == 'include' for kind, _ in self.criteria)
+
+    @property
+    def excluded(self):
+        return any(kind == 'exclude' for kind, _ in self.criteria)
+
+
+def disorder_pool(flags):
+    # MDD, PTSD, SZ, BD are mutually exclusive pools; first flagged disorder wins
+    for disorder in DISORDERS:
+        if flags[disorder] == 1:
+            return disorder
+    return ''
+
+
+def flag_disorders(entry, flags):
+    # specifically flag MDD, PTSD, Schizophrenia, BD
+    if 'MDD' in entry or 'depres' in entry:
+        flags['MDD'] = 1
+    elif 'PTSD' in entry:
+        flags['PTSD'] = 1
+    elif 'schizo' in entry:
+        flags['SZ'] = 1
+    elif 'bipolar' in entry:
+        flags['BD'] = 1
+
+
+def iter_records(root):
+    for allrecords in root.findall('records'):
+        for thisrecord in allrecords.findall('record'):
+            yield thisrecord
+
+
+def iterparse_records(xml_filename):
+    # Streaming alternative to iter_records(ET.parse(xml_filename).getroot()) for very large exports.
+    # Yields one <record> (directly under <records>) at a time, and clears it once the caller moves on,
+    # so peak memory does not grow with the size of the export.
+    path = []
+    for event, elem in ET.iterparse(xml_filename, events=('start', 'end')):
+        if event == 'start':
+            path.append(elem)
+            continue
+        path.pop()
+        if elem.tag == 'record' and len(path) == 2 and path[-1].tag == 'records':
+            yield elem
+            elem.clear()
+            path[-1].remove(elem)
+
+
+def record_fields(thisrecord):
+    # the raw text extract_study needs from a record:  author surname, year, title, rec-number and research-notes.
+    # Plain strings, so cheap to send to worker processes (see iter_studies_parallel)
+
+    # extract year
+    thisdate = thisrecord.findall('dates')
+    thisyear = thisdate[0][0].text
+
+    # extract title
+    thistitles = thisrecord.findall('titles')
+    thistitle = thistitles[0][0].text if len(thistitles) > 0 else None
+
+    # extract first author surname
+    thiscontributors = thisrecord.findall('contributors')
+    if len(thiscontributors) == 0:
+        thisauthor_full = 'BLANK'
+    else:
+        thisauthor_full = thiscontributors[0][0][0].text
+    thisauthor_lastname = thisauthor_full.split(',')[0]
+
+    research_notes = [str(temp.text) for temp in thisrecord.findall('research-notes')]
+
+    return thisauthor_lastname, thisyear, thistitle, thisrecord.findtext('rec-number'), research_notes
+
+
+def extract_study(thisrecord):
+    return study_from_fields(*record_fields(thisrecord))
+
+
+def study_from_fields(author, year, title, rec_number, research_notes):
+    study = Study(author=author, year=year, title=title, rec_number=rec_number)
+    study.has_notes = len(research_notes) > 0
+
+    # each factor has its own block currently being filled (kept for the whole record),
+    # and whether coordinates are being written (reset for each research-notes field)
+    current = dict.fromkeys(FACTORS)
+    for line in research_notes:
+        writing = dict.fromkeys(FACTORS, False)
+
+        for raw_entry in line.split('\r\r'):
+            study.entries += 1
+            entry = raw_entry.replace('&nbsp;', ' ')  # sometimes Zotero web-version replaces spaces with &nbsp;
+            line_type = classify_line(entry)  # each line is classified only once, for both factors
+
+            if line_type.sample_size:
+                # sample size is taken from the last N=xxx in the notes, before any &nbsp; clean-up
+                study.N = raw_entry.split('=')[1]
+
+            if 'diseas' in entry:  # extract relevant disorder
+                disorder_str = entry.split(' ')
+                if len(disorder_str) > 2:
+                    study.disorder = disorder_str[2]
+
+            flag_disorders(entry, study.flags)
+
+            coordinates = None  # label x y z, split at most once
+            for factor, action in line_type.actions:
+                if action == HEADER:
+                    reference = header_reference(entry)
+                    if reference is not None:
+                        current[factor] = CoordinateBlock(reference)
+                        writing[factor] = True
+                    else:
+                        # Some articles met inclusion criteria but did not report coordinates in MNI or TT,
+                        # e.g. reported freesurfer regions or Destrieux atlas; keep any earlier block as is
+                        writing[factor] = False
+                        study.nonMNIorTT[factor] += 1
+                elif action == STOP:
+                    writing[factor] = False
+                elif writing[factor]:  # one or more lines of coordinates to write
+                    if coordinates is None:
+                        coordinates = parse_coordinate_line(entry)
+                    if coordinates is MALFORMED:
+                        study.malformed.append((factor, entry))
+                    else:
+                        current[factor].coordinates.append(coordinates)
+
+            # reasons for inclusion or exclusion
+            if line_type.inclusion:
+                study.criteria.append(('include', entry))
+            elif 'exc' in entry and 'keep' not in entry:  # adjust for occasional note '1st keep (but maybe exclude later)'
+                study.criteria.append(('exclude', entry))
+
+        # a block is finalized at the end of each research-notes field, with the disorders flagged so far
+        pool = disorder_pool(study.flags)
+        for factor in FACTORS:
+            if current[factor] is not None:
+                getattr(study, factor).append(replace(current[factor], pool=pool))
+
+    return study
+
+
+def extract_studies(root):
+    return [extract_study(thisrecord) for thisrecord in iter_records(root)]
+
+
+def extract_fields_chunk(chunk):
+    # runs in a worker process:  the parent only pulls the raw fields out of each record (record_fields),
+    # and the notes are parsed here
+    return [study_from_fields(*fields) for fields in chunk]
+
+
+def process_pool_context():
+    # Worker processes are forked where possible (cheapest start).  Elsewhere (Windows) they are spawned, which
+    # re-imports the calling script - fine now that import_zotero_xml_output_all.py only runs under __main__
+    import multiprocessing
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return multiprocessing.get_context('spawn')
+
+
+def iter_studies_parallel(records, workers, cache=None, chunksize=200):
+    # Shards records across a pool of worker processes, in chunks of chunksize records,
+    # and yields studies in the original record order so output files stay diff-stable.
+    # Only a few chunks per worker are in flight at once, so this also works with streaming.
+    from collections import deque
+    from concurrent.futures import ProcessPoolExecutor
+
+    def finish(lookups, future):
+        extracted = iter(future.result()) if future is not None else iter(())
+        for identity, digest, study in lookups:
+            if study is None:
+                study = next(extracted)
+            if cache is not None:
+                cache.store(identity, digest, study)  # cache hits too, or save() would drop them
+            yield study
+
+    pending = deque()  # (lookups, future) for each chunk, in record order
+    with ProcessPoolExecutor(max_workers=workers, mp_context=process_pool_context()) as executor:
+
+        def submit(lookups, to_extract):
+            future = executor.submit(extract_fields_chunk, to_extract) if len(to_extract) > 0 else None
+            pending.append((lookups, future))
+
+        lookups = []  # (identity, digest, cached study or None) for each record in this chunk
+        to_extract = []  # fields of the records that need extracting
+        for thisrecord in records:
+            # read the record right away:  with streaming, it is cleared as soon as we ask for the next one
+            if cache is not None:
+                lookup = cache.lookup(thisrecord)
+            else:
+                lookup = (None, None, None)
+            if lookup[2] is None:
+                to_extract.append(record_fields(thisrecord))
+            lookups.append(lookup)
+            if len(lookups) == chunksize:
+                submit(lookups, to_extract)
+                lookups, to_extract = [], []
+                while len(pending) >= 4 * workers:
+                    yield from finish(*pending.popleft())
+        if len(lookups) > 0:
+            submit(lookups, to_extract)
+        while pending:
+            yield from finish(*pending.popleft())
+
+
+def iter_studies(xml_filename, streaming=False, cache=None, workers=1, stats=None):
+    # streaming=True parses one record at a time with iterparse; otherwise the whole tree is loaded first.
+    # Both give the same studies in the same order.
+    # cache (a StudyCache, see study_cache.py) re-uses studies from earlier runs for records that haven't changed
+    # workers > 1 extracts records in parallel across that many processes (same studies, same order)
+    # stats (a PipelineStats, see pipeline_stats.py) times parsing separately from extraction
+    if streaming:
+        records = iterparse_records(xml_filename)
+        if stats is not None:
+            records = stats.iterate('parse', records)
+    else:
+        if stats is not None:
+            with stats.stage('parse'):
+                root = ET.parse(xml_filename).getroot()
+        else:
+            root = ET.parse(xml_filename).getroot()
+        records = iter_records(root)
+    if workers > 1:
+        yield from iter_studies_parallel(records, workers, cache=cache)
+        return
+    extract = extract_study if cache is None else cache.extract
+    for thisrecord in records:
+        yield extract(thisrecord)
+